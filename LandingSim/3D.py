@@ -1,12 +1,44 @@
-import pygame
 import math
 import random
-import pickle
 import os
-from perlin_noise import PerlinNoise
-from pygame.locals import *
-from OpenGL.GL import *
-from OpenGL.GLU import *
+import sys
+import ctypes
+import struct
+import threading
+import argparse
+import importlib
+import json
+import time
+import timeit
+import tempfile
+import io
+import gc
+import csv
+import zlib
+import asyncio
+import socket
+import stat
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# pygame и OpenGL подгружаются в load_gl() только для интерактивного режима
+pygame = None
+
+def _import_star(module_name):
+    module = importlib.import_module(module_name)
+    names = getattr(module, '__all__', None)
+    if names is None:
+        names = [name for name in vars(module) if not name.startswith('_')]
+    globals().update({name: getattr(module, name) for name in names})
+
+def load_gl():
+    global pygame
+    if pygame is not None:
+        return
+    pygame = importlib.import_module('pygame')
+    _import_star('pygame.locals')
+    _import_star('OpenGL.GL')
+    _import_star('OpenGL.GLU')
 
 def NameToCoords(name):
     a, b = name.split("_")
@@ -22,6 +54,8 @@ def vector_product(a, b):
     return Vector3(a.y*b.z - a.z*b.y, a.x*b.z - a.z*b.x, a.x*b.y - a.y*b.x)
 
 class Vector3:
+    __slots__ = ('x', 'y', 'z', 'length')
+    
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -31,13 +65,623 @@ class Vector3:
     def normalized(self):
         return Vector3(self.x/self.length, self.y/self.length, self.z/self.length)
 
+# Слои рельефа: (октавы, сид, масштаб координат, амплитуда)
+TERRAIN_LAYERS = ((2, 4522, 5, 0.03), (3, 345, 20, 0.03), (3, 235, 80, 0.01))
+# Максимальное расхождение высот с perlin_noise.PerlinNoise при тех же сидах и октавах
+TERRAIN_TOLERANCE = 1e-9
+# Оценка сверху отклонения рельефа от радиуса планеты (шум Перлина по модулю не больше 1)
+TERRAIN_RELIEF = sum(amplitude for _, _, _, amplitude in TERRAIN_LAYERS)
+
+def _fade(t):
+    return 6 * t**5 - 15 * t**4 + 10 * t**3
+
+class PerlinField:
+    # Двумерный шум Перлина, совместимый с perlin_noise.PerlinNoise, но считающий массивы точек за раз
+    def __init__(self, octaves, seed):
+        self.octaves = octaves
+        self.seed = seed
+        self._gradients = {}
+
+    def _gradients_at(self, cx, cy):
+        hashes = np.maximum(1, np.abs(cx.astype(np.int64) + 10 * cy.astype(np.int64) + 1))
+        keys, inverse = np.unique(hashes, return_inverse=True)
+        grads = np.empty((len(keys), 2))
+        for k, key in enumerate(keys.tolist()):
+            grad = self._gradients.get(key)
+            if grad is None:
+                rnd = random.Random(self.seed * key)
+                grad = (rnd.uniform(-1, 1), rnd.uniform(-1, 1))
+                self._gradients[key] = grad
+            grads[k] = grad
+        grads = grads[inverse.reshape(-1)].reshape(hashes.shape + (2,))
+        return grads[..., 0], grads[..., 1]
+
+    def __call__(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float) * self.octaves,
+                                   np.asarray(y, dtype=float) * self.octaves)
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        total = np.zeros(x.shape)
+        for cx in (x0, x0 + 1):
+            dx = x - cx
+            wx = _fade(1 - np.abs(dx))
+            for cy in (y0, y0 + 1):
+                dy = y - cy
+                gx, gy = self._gradients_at(cx, cy)
+                total += wx * _fade(1 - np.abs(dy)) * (gx * dx + gy * dy)
+        return total
+
+class TerrainHeight:
+    # Движок высот: хранит состояние шума между вызовами и принимает массивы долгот/широт (радианы)
+    def __init__(self, seed=0, layers=TERRAIN_LAYERS):
+        self.seed = seed
+        self.layers = [(PerlinField(octaves, layer_seed + seed), scale, amplitude)
+                       for octaves, layer_seed, scale, amplitude in layers]
+
+    def height(self, radius, longitude, latitude):
+        longitude = np.asarray(longitude, dtype=float)
+        latitude = np.asarray(latitude, dtype=float)
+        height = radius
+        for field, scale, amplitude in self.layers:
+            height = height + amplitude * field(longitude * scale, latitude * scale)
+        if np.ndim(height) == 0:
+            return float(height)
+        return height
+
+_terrains = {}
+
+def get_terrain(seed=0):
+    terrain = _terrains.get(seed)
+    if terrain is None:
+        terrain = _terrains[seed] = TerrainHeight(seed)
+    return terrain
+
+def check_terrain(samples=500, seed=0, radius=7):
+    # Сверка с эталонной реализацией perlin_noise: отклонение не больше TERRAIN_TOLERANCE; возвращает его
+    from perlin_noise import PerlinNoise
+    rnd = random.Random(seed)
+    points = [(rnd.uniform(-math.pi, math.pi), rnd.uniform(-math.pi/2, math.pi/2)) for _ in range(samples)]
+    noises = [(PerlinNoise(octaves=octaves, seed=layer_seed + seed), scale, amplitude)
+              for octaves, layer_seed, scale, amplitude in TERRAIN_LAYERS]
+    expected = []
+    for longitude, latitude in points:
+        height = radius
+        for noise, scale, amplitude in noises:
+            height = height + amplitude * noise([longitude*scale, latitude*scale])
+        expected.append(height)
+    lons, lats = np.array(points).T
+    error = float(np.max(np.abs(get_terrain(seed).height(radius, lons, lats) - np.array(expected))))
+    if error > TERRAIN_TOLERANCE:
+        raise RuntimeError(f"рельеф расходится с perlin_noise на {error:g} > {TERRAIN_TOLERANCE:g}")
+    return error
+
+TILE_MAGIC = b"LSTL"
+PLANET_MAGIC = b"LSPL"
+TILE_VERSION = 3
+TILE_HEADER_SIZE = 64
+DEFAULT_TILE_DIR = "tile_cache"
+# Память под сектора, ушедшие из окна планеты (SectorCache)
+SECTOR_CACHE_BYTES = 64 * 2**20
+# Сторона блока ячеек сетки, целиком отбрасываемого в Planet.sweep по наибольшей высоте
+COLLISION_BLOCK = 8
+# magic, версия, сид, радиус, детализация, долгота и широта сектора в градусах
+_TILE_HEADER = struct.Struct("<4sIqdIii")
+# то же для планеты плюс радиус прорисовки; за заголовком идут сектора в формате тайлов
+_PLANET_HEADER = struct.Struct("<4sIqdIiiI")
+
+def tile_size(details):
+    return TILE_HEADER_SIZE + 7 * 4 * (details + 1) ** 2
+
+def mesh_views(mesh):
+    # Сетка хранится одним непрерывным массивом float32: вершины (N*3), нормали (N*3), высоты (N)
+    n = len(mesh) // 7
+    return mesh[:3*n].reshape(n, 3), mesh[3*n:6*n].reshape(n, 3), mesh[6*n:]
+
+def write_tile(f, key, mesh):
+    seed, radius, details, lon, lat = key
+    f.write(_TILE_HEADER.pack(TILE_MAGIC, TILE_VERSION, seed, radius, details, lon, lat).ljust(TILE_HEADER_SIZE, b"\0"))
+    f.write(np.ascontiguousarray(mesh, dtype=np.float32).tobytes())
+
+def map_tile(filename, offset=0):
+    # Массивы отображаются из файла без копирования
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        header = f.read(_TILE_HEADER.size)
+    if len(header) < _TILE_HEADER.size:
+        raise ValueError("файл сектора обрезан")
+    magic, version, seed, radius, details, lon, lat = _TILE_HEADER.unpack(header)
+    if magic != TILE_MAGIC:
+        raise ValueError("не файл сектора")
+    if version != TILE_VERSION:
+        raise ValueError(f"версия сектора {version}, ожидалась {TILE_VERSION}")
+    n = (details + 1) ** 2
+    mesh = np.memmap(filename, dtype=np.float32, mode='r', offset=offset + TILE_HEADER_SIZE, shape=(7 * n,))
+    return (seed, radius, details, lon, lat), mesh, offset + tile_size(details)
+
+class TileStore:
+    # Дисковый кэш сеток секторов, ключ (сид, радиус, детализация, долгота, широта).
+    # При превышении max_bytes удаляются давно не читавшиеся тайлы
+    def __init__(self, directory=DEFAULT_TILE_DIR, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+    
+    def path(self, key):
+        seed, radius, details, lon, lat = key
+        return os.path.join(self.directory, f"{seed}_{float(radius)!r}_{details}_{lon}_{lat}.tile")
+    
+    def __contains__(self, key):
+        # Готовый тайл текущей версии; читается только заголовок, счётчики и время доступа не меняются
+        try:
+            with open(self.path(key), 'rb') as f:
+                header = f.read(_TILE_HEADER.size)
+        except OSError:
+            return False
+        if len(header) < _TILE_HEADER.size:
+            return False
+        magic, version, *stored_key = _TILE_HEADER.unpack(header)
+        return magic == TILE_MAGIC and version == TILE_VERSION and tuple(stored_key) == tuple(key)
+    
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+    
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".tile"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+    
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._size -= size
+    
+    def get(self, key):
+        path = self.path(key)
+        try:
+            stored_key, mesh, _ = map_tile(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except ValueError:
+            # Устаревшая версия формата или испорченный файл
+            self._remove(path)
+            self.misses += 1
+            return None
+        if stored_key != tuple(key):
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return mesh
+    
+    def put(self, key, mesh):
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            write_tile(f, key, mesh)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Файл открыт другим процессом (Windows) - он уже содержит этот же тайл
+            os.remove(tmp)
+            return
+        self._size += tile_size(key[2])
+        if self._size > self.max_bytes:
+            self.evict()
+    
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._size = total
+
+def sample_grid(grid, details, min_lon, min_lat, step, longitude, latitude, with_gradient=False, tile=None):
+    # Билинейная интерполяция по сетке (details+1)x(details+1): строки - широта, столбцы - долгота.
+    # С with_gradient дополнительно возвращает производные по долготе и широте (на радиан).
+    # С tile grid - стопка сеток, tile - номер сетки для каждой точки, min_lon и min_lat - массивы
+    if tile is None and not with_gradient and np.ndim(longitude) == 0 and np.ndim(latitude) == 0:
+        return _sample_grid_scalar(grid, details, min_lon, min_lat, step, longitude, latitude)
+    u = np.clip((np.asarray(longitude, dtype=float) - min_lon) / step, 0, details)
+    v = np.clip((np.asarray(latitude, dtype=float) - min_lat) / step, 0, details)
+    j = np.minimum(u.astype(np.int64), details - 1)
+    i = np.minimum(v.astype(np.int64), details - 1)
+    fu = u - j
+    fv = v - i
+    n = details + 1
+    grid = grid.reshape(-1)
+    index = i * n + j
+    if tile is not None:
+        index += np.asarray(tile) * (n * n)
+    h00 = grid[index]
+    h01 = grid[index + 1]
+    h10 = grid[index + n]
+    h11 = grid[index + n + 1]
+    bottom = h00 * (1 - fu) + h01 * fu
+    top = h10 * (1 - fu) + h11 * fu
+    height = bottom * (1 - fv) + top * fv
+    if not with_gradient:
+        return height
+    d_lon = ((h01 - h00) * (1 - fv) + (h11 - h10) * fv) / step
+    d_lat = (top - bottom) / step
+    return height, d_lon, d_lat
+
+def surface_normals(longitude, latitude, height, d_lon, d_lat):
+    # Нормаль к поверхности r = h(lon, lat): n - h_lon/(h cos lat) * e_lon - h_lat/h * e_lat
+    cos_lat = np.cos(latitude)
+    sin_lat = np.sin(latitude)
+    cos_lon = np.cos(longitude)
+    sin_lon = np.sin(longitude)
+    a = d_lon / (height * np.maximum(cos_lat, 1e-9))
+    b = d_lat / height
+    normals = np.stack([
+        cos_lat * cos_lon + a * sin_lon + b * sin_lat * cos_lon,
+        sin_lat - b * cos_lat,
+        cos_lat * sin_lon - a * cos_lon + b * sin_lat * sin_lon,
+    ], axis=-1)
+    return normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+
+def ray_triangle(origins, directions, triangles):
+    # Пересечение отрезков origin + t * direction, t от 0 до 1, с треугольниками (..., 3, 3) (Мёллер - Трумбор);
+    # аргументы согласуются по правилам broadcasting. Возвращает t или inf, если пересечения нет
+    a = triangles[..., 0, :]
+    e1 = triangles[..., 1, :] - a
+    e2 = triangles[..., 2, :] - a
+    p = np.cross(directions, e2)
+    det = np.sum(e1 * p, axis=-1)
+    valid = np.abs(det) > 1e-15
+    inverse = 1 / np.where(valid, det, 1)
+    offset = origins - a
+    u = np.sum(offset * p, axis=-1) * inverse
+    q = np.cross(offset, e1)
+    v = np.sum(directions * q, axis=-1) * inverse
+    t = np.sum(e2 * q, axis=-1) * inverse
+    hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= 1)
+    return np.where(hit, t, np.inf)
+
+def _sample_grid_scalar(grid, details, min_lon, min_lat, step, longitude, latitude):
+    # То же для одной точки без накладных расходов NumPy - вызывается на каждом шаге физики
+    u = min(max((longitude - min_lon) / step, 0.0), details)
+    v = min(max((latitude - min_lat) / step, 0.0), details)
+    j = min(int(u), details - 1)
+    i = min(int(v), details - 1)
+    fu = u - j
+    fv = v - i
+    k = i * (details + 1) + j
+    h00, h01 = grid[k:k + 2].tolist()
+    h10, h11 = grid[k + details + 1:k + details + 3].tolist()
+    return (h00 * (1 - fu) + h01 * fu) * (1 - fv) + (h10 * (1 - fu) + h11 * fu) * fv
+
+class TileTerrain:
+    # Высоты поверхности по сеткам секторов из TileStore; недостающие тайлы строятся и сохраняются.
+    # Загруженные сетки лежат стопкой в одном массиве, чтобы массив точек интерполировался одним вызовом
+    def __init__(self, store, radius=7, details=32, seed=0, keep_tiles=256):
+        self.store = store
+        self.radius = radius
+        self.details = details
+        self.seed = seed
+        self.keep_tiles = keep_tiles
+        self._tiles = {}
+        self._grids = np.empty((keep_tiles, (details + 1) ** 2), dtype=np.float32)
+    
+    def _tile(self, lon, lat):
+        slot = self._tiles.get((lon, lat))
+        if slot is None:
+            if len(self._tiles) >= len(self._grids):
+                self._tiles.clear()
+            sector = SphereSector(self.radius, math.radians(lon), math.radians(lat), lon, lat, self.details, self.seed, self.store)
+            slot = self._tiles[(lon, lat)] = len(self._tiles)
+            self._grids[slot] = mesh_views(sector.load_mesh())[2]
+        return slot
+    
+    def height(self, longitude, latitude):
+        step = math.radians(1) / self.details
+        if np.ndim(longitude) == 0 and np.ndim(latitude) == 0:
+            lon = round(math.degrees(longitude))
+            lat = round(math.degrees(latitude))
+            return float(sample_grid(self._grids[self._tile(lon, lat)], self.details, math.radians(lon) - math.radians(1)/2,
+                                     math.radians(lat) - math.radians(1)/2, step, longitude, latitude))
+        longitude, latitude = np.broadcast_arrays(np.asarray(longitude, dtype=float), np.asarray(latitude, dtype=float))
+        deg_lon = np.rint(np.degrees(longitude)).astype(np.int64)
+        deg_lat = np.rint(np.degrees(latitude)).astype(np.int64)
+        cells, inverse = np.unique(np.stack([deg_lon.ravel(), deg_lat.ravel()]), axis=1, return_inverse=True)
+        cells = cells.T.tolist()
+        missing = sum((lon, lat) not in self._tiles for lon, lat in cells)
+        if len(self._tiles) + missing > len(self._grids):
+            # Все тайлы вызова должны поместиться в стопку одновременно
+            self._tiles.clear()
+            if len(cells) > len(self._grids):
+                self._grids = np.empty((len(cells),) + self._grids.shape[1:], dtype=np.float32)
+        slots = np.array([self._tile(lon, lat) for lon, lat in cells])
+        heights = sample_grid(self._grids, self.details, np.radians(deg_lon) - math.radians(1)/2, np.radians(deg_lat) - math.radians(1)/2,
+                              step, longitude, latitude, tile=slots[inverse.reshape(deg_lon.shape)])
+        return heights
+
+class SuitabilityMap:
+    # Карты для выбора места посадки в узлах общей решётки уровня details (см. lattice_angles): высота
+    # над радиусом, уклон в градусах и шероховатость - СКО высот окна 3x3 от подогнанной по нему плоскости.
+    # Тайл - сектор 1°, узлы g = deg*details + 0..details-1 по обеим осям, так что тайлы не перекрываются.
+    # Недостающие тайлы считаются пачками по batch одним вызовом шума и хранятся в LRU на max_tiles тайлов
+    fields = ("height", "slope", "roughness")
+    
+    def __init__(self, radius=7, details=16, seed=0, max_tiles=8192, batch=256):
+        self.radius = radius
+        self.details = details
+        self.seed = seed
+        self.max_tiles = max_tiles
+        self.batch = batch
+        self.hits = 0
+        self.misses = 0
+        self._tiles = {}
+    
+    def _compute(self, cells):
+        # Карты тайлов cells (n, 2) - (n, 3, details, details); высоты берутся с кольцом в один узел
+        d = self.details
+        n = len(cells)
+        ring = np.arange(-1, d + 1)
+        lon = np.radians((cells[:, :1] * d + ring) / d - 0.5)
+        lat = np.radians((cells[:, 1:] * d + ring) / d - 0.5)
+        heights = get_terrain(self.seed).height(self.radius, np.broadcast_to(lon[:, None, :], (n, d + 2, d + 2)),
+                                                np.broadcast_to(lat[:, :, None], (n, d + 2, d + 2)))
+        window = [[heights[:, a:a + d, b:b + d] for b in range(3)] for a in range(3)]
+        center = window[1][1]
+        # Плоскость наименьших квадратов по окну 3x3: среднее и наклоны по столбцам (долгота) и строкам (широта)
+        mean = sum(sum(row) for row in window) / 9
+        d_lon = (sum(row[2] for row in window) - sum(row[0] for row in window)) / 6
+        d_lat = (sum(window[2]) - sum(window[0])) / 6
+        residual = sum((window[a][b] - mean - (b - 1) * d_lon - (a - 1) * d_lat) ** 2 for a in range(3) for b in range(3))
+        # Уклон - по центральным разностям, как нормали сеток секторов (SphereSector._set_normals)
+        step = math.radians(1) / d
+        east = (window[1][2] - window[1][0]) / (2 * center * np.cos(lat[:, 1:-1, None]) * step)
+        north = (window[2][1] - window[0][1]) / (2 * center * step)
+        maps = np.empty((n, 3, d, d), dtype=np.float32)
+        maps[:, 0] = center - self.radius
+        maps[:, 1] = np.degrees(np.arctan(np.hypot(east, north)))
+        maps[:, 2] = np.sqrt(residual / 9)
+        return maps
+    
+    def tiles(self, cells):
+        # Карты тайлов cells (список (lon, lat) в градусах) - (n, 3, details, details)
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        keys = list(map(tuple, cells.tolist()))
+        result = np.empty((len(keys), 3, self.details, self.details), dtype=np.float32)
+        missing = []
+        for k, key in enumerate(keys):
+            maps = self._tiles.pop(key, None)
+            if maps is None:
+                missing.append(k)
+                continue
+            self._tiles[key] = maps
+            result[k] = maps
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        for start in range(0, len(missing), self.batch):
+            part = missing[start:start + self.batch]
+            result[part] = self._compute(cells[part])
+            for k in part:
+                self._tiles[keys[k]] = result[k]
+                if len(self._tiles) > self.max_tiles:
+                    del self._tiles[next(iter(self._tiles))]
+        return result
+    
+    def region(self, min_lon, min_lat, max_lon, max_lat):
+        # Карты узлов прямоугольника (градусы): lon и lat - оси узлов, height, slope и roughness -
+        # массивы (широта, долгота)
+        d = self.details
+        lon0, lon1 = math.floor(min_lon + 0.5), math.floor(max_lon + 0.5)
+        lat0, lat1 = math.floor(min_lat + 0.5), math.floor(max_lat + 0.5)
+        cells = [(lon, lat) for lat in range(lat0, lat1 + 1) for lon in range(lon0, lon1 + 1)]
+        maps = self.tiles(cells).reshape(lat1 - lat0 + 1, lon1 - lon0 + 1, 3, d, d)
+        maps = maps.transpose(2, 0, 3, 1, 4).reshape(3, (lat1 - lat0 + 1) * d, (lon1 - lon0 + 1) * d)
+        lon = np.arange(lon0 * d, (lon1 + 1) * d) / d - 0.5
+        lat = np.arange(lat0 * d, (lat1 + 1) * d) / d - 0.5
+        columns = (lon >= min_lon) & (lon <= max_lon)
+        rows = (lat >= min_lat) & (lat <= max_lat)
+        result = {'lon': lon[columns], 'lat': lat[rows]}
+        for name, values in zip(self.fields, maps):
+            result[name] = values[rows][:, columns]
+        return result
+    
+    def best_sites(self, min_lon, min_lat, max_lon, max_lat, k=10, separation=0.25, max_roughness=None):
+        # k самых пологих узлов прямоугольника, попарно не ближе separation градусов дуги; с max_roughness -
+        # только достаточно гладкие. Возвращает lon, lat (градусы) и карты в этих узлах, от лучшего к худшему
+        maps = self.region(min_lon, min_lat, max_lon, max_lat)
+        width = len(maps['lon'])
+        score = maps['slope'].ravel().astype(float)
+        if max_roughness is not None:
+            score[maps['roughness'].ravel() > max_roughness] = np.inf
+        chosen = []
+        count = min(len(score), 64 * k)
+        while count:
+            candidates = np.argpartition(score, count - 1)[:count] if count < len(score) else np.arange(len(score))
+            candidates = candidates[np.argsort(score[candidates], kind='stable')]
+            candidates = candidates[np.isfinite(score[candidates])]
+            rows, cols = np.divmod(candidates, width)
+            lat = np.radians(maps['lat'][rows])
+            lon = np.radians(maps['lon'][cols])
+            points = np.stack([np.cos(lat) * np.cos(lon), np.sin(lat), np.cos(lat) * np.sin(lon)], axis=1)
+            chosen = []
+            limit = math.cos(math.radians(separation))
+            for c in range(len(candidates)):
+                if chosen and (points[chosen] @ points[c]).max() > limit:
+                    continue
+                chosen.append(c)
+                if len(chosen) == k:
+                    break
+            # В большой пологой области кандидаты идут кучно - не хватило, берётся вчетверо больше
+            if len(chosen) == k or count == len(score):
+                break
+            count = min(len(score), 4 * count)
+        index = candidates[chosen] if chosen else np.zeros(0, dtype=np.int64)
+        rows, cols = np.divmod(index, width)
+        result = {'lon': maps['lon'][cols], 'lat': maps['lat'][rows]}
+        for name in self.fields:
+            result[name] = maps[name][rows, cols]
+        return result
+
+def sphere_visibility(centers, radii, planes, eye, occluder):
+    # Сферы (centers, radii), пересекающие пирамиду видимости и не скрытые за сферой радиуса occluder
+    visible = np.all(centers @ planes[:, :3].T + planes[:, 3] >= -radii[:, None], axis=1)
+    distance = np.linalg.norm(eye)
+    if distance > occluder:
+        axis = -eye / distance
+        to_center = centers - eye
+        along = to_center @ axis
+        # За плоскостью горизонта
+        beyond = along - radii > (distance**2 - occluder**2) / distance
+        # Внутри конуса касательных к сфере из камеры
+        length = np.linalg.norm(to_center, axis=1)
+        angle = np.arccos(np.clip(along / length, -1, 1)) + np.arcsin(np.clip(radii / length, 0, 1))
+        inside_cone = (length > radii) & (angle <= math.asin(occluder / distance))
+        visible &= ~(beyond & inside_cone)
+    return visible
+
+def cast_rays(planet, step, origins, directions, max_distance=np.inf, slope=None, iterations=8):
+    # Пересечение лучей origin + t * direction (n, 3) с рельефом planet.query. Луч обрезается
+    # сферическим слоем radius +- TERRAIN_RELIEF, внутри слоя все лучи идут вместе шагами step
+    # до первой точки под поверхностью, затем точка уточняется методом хорд в иллинойсском варианте
+    # (внутри ячейки рельеф билинейный, так что хватает нескольких итераций). Если известна крутизна
+    # рельефа slope, точка с высотой f над ним отстоит от поверхности не меньше чем на f / (1 + slope)
+    # по любому направлению, и пустая часть слоя проходится такими прыжками.
+    # Возвращает расстояния (inf без пересечения), точки и нормали (nan); directions нормируются
+    origins, directions = np.broadcast_arrays(np.asarray(origins, dtype=float), np.asarray(directions, dtype=float))
+    origins = origins.reshape(-1, 3)
+    directions = directions.reshape(-1, 3) / np.linalg.norm(directions.reshape(-1, 3), axis=1, keepdims=True)
+    n = len(origins)
+    distance = np.full(n, np.inf)
+    points = np.full((n, 3), np.nan)
+    normals = np.full((n, 3), np.nan)
+    radius = planet.radius
+    
+    def clearance(index, t):
+        # Высота точек лучей над рельефом; t той же формы, что index, или (len(index), k)
+        p = origins[index] + t[..., None] * directions[index] if t.ndim == 1 else \
+            origins[index, None] + t[..., None] * directions[index, None]
+        r = np.linalg.norm(p, axis=-1)
+        return r - planet.query(np.arctan2(p[..., 2], p[..., 0]), np.arcsin(np.clip(p[..., 1] / r, -1, 1)), with_normals=False)
+    
+    b = np.einsum('ij,ij->i', origins, directions)
+    c = np.einsum('ij,ij->i', origins, origins)
+    outer = b * b - c + (radius + TERRAIN_RELIEF) ** 2
+    inner = b * b - c + (radius - TERRAIN_RELIEF) ** 2
+    enter = np.maximum(-b - np.sqrt(np.maximum(outer, 0)), 0)
+    leave = -b + np.sqrt(np.maximum(outer, 0))
+    # Под внутренней сферой рельефа нет: дальше неё луч не проверяется
+    hits_inner = (inner > 0) & (-b - np.sqrt(np.maximum(inner, 0)) > 0)
+    leave = np.where(hits_inner, -b - np.sqrt(np.maximum(inner, 0)), leave)
+    leave = np.minimum(leave, max_distance)
+    index = np.flatnonzero((outer > 0) & (leave >= enter))
+    low = enter[index]
+    f_low = clearance(index, low)
+    # Начало уже под поверхностью - пересечение в начале
+    start = f_low <= 0
+    distance[index[start]] = low[start]
+    index = index[~start]
+    low = low[~start]
+    f_low = f_low[~start]
+    
+    found = [[], [], [], [], []]
+    samples = 1
+    while len(index):
+        skip = step if slope is None else np.maximum(f_low / (1 + slope), step)[:, None]
+        t = np.minimum(low[:, None] + skip + step * np.arange(samples), leave[index, None])
+        f = clearance(index, t)
+        below = f <= 0
+        rows = np.flatnonzero(below.any(axis=1))
+        first = np.argmax(below[rows], axis=1)
+        previous = np.maximum(first - 1, 0)
+        for bucket, values in zip(found, (index[rows], np.where(first > 0, t[rows, previous], low[rows]), t[rows, first],
+                                          np.where(first > 0, f[rows, previous], f_low[rows]), f[rows, first])):
+            bucket.append(values)
+        going = ~below.any(axis=1) & (t[:, -1] < leave[index])
+        index = index[going]
+        low = t[going, -1]
+        f_low = f[going, -1]
+        # Крутые лучи доходят до рельефа за несколько прыжков, длинным пологим - блоки всё крупнее
+        samples = min(2 * samples, 64)
+    if found[0]:
+        index, low, high, f_low, f_high = (np.concatenate(values) for values in found)
+        last = np.zeros(len(index), dtype=np.int8)
+        for _ in range(iterations):
+            middle = low + (high - low) * f_low / (f_low - f_high)
+            f = clearance(index, middle)
+            # Сошедшиеся лучи выходят из уточнения, дальше считаются только остальные
+            done = np.abs(f) < 1e-9 * radius
+            distance[index[done]] = middle[done]
+            going = ~done
+            index, low, high, f_low, f_high, last, middle, f = (
+                values[going] for values in (index, low, high, f_low, f_high, last, middle, f))
+            if len(index) == 0:
+                break
+            under = f <= 0
+            # Конец, который не сдвинулся второй раз подряд, весит вдвое меньше
+            f_low = np.where(under & (last > 0), f_low / 2, f_low)
+            f_high = np.where(~under & (last < 0), f_high / 2, f_high)
+            last = np.where(under, 1, -1).astype(np.int8)
+            high = np.where(under, middle, high)
+            f_high = np.where(under, f, f_high)
+            low = np.where(under, low, middle)
+            f_low = np.where(under, f_low, f)
+        distance[index] = high
+    hit = np.flatnonzero(np.isfinite(distance))
+    if len(hit):
+        points[hit] = origins[hit] + distance[hit, None] * directions[hit]
+        r = np.linalg.norm(points[hit], axis=1)
+        normals[hit] = planet.query(np.arctan2(points[hit, 2], points[hit, 0]), np.arcsin(np.clip(points[hit, 1] / r, -1, 1)))[1]
+    return distance, points, normals
+
+def line_of_sight(planet, a, b):
+    # Видны ли точки b из точек a (массивы (n, 3)): отрезок не уходит под рельеф
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    length = np.linalg.norm(b - a, axis=-1)
+    return np.isinf(planet.raycast(a, b - a, length.reshape(-1) * (1 - 1e-6))[0]).reshape(length.shape)
+
 class Planet:
-    def __init__(self, radius_render=1, longitude=0, latitude=0, radius=7, details=32):
+    def __init__(self, radius_render=1, longitude=0, latitude=0, radius=7, details=32, seed=0, store=None, cache_bytes=SECTOR_CACHE_BYTES):
         self.radius_render = radius_render
         self.longitude = longitude 
         self.latitude = latitude
         self.radius = radius
         self.details = details
+        self.seed = seed
+        self.store = store
+        # Узлы у границ секторов, общие для соседей
+        self.edges = SharedEdges(radius, seed)
+        # Сектора, ушедшие из окна (см. update_sectors)
+        self.cache = SectorCache(cache_bytes)
+        # Уровень детализации сектора растёт на 1 при каждом удвоении расстояния сверх lod_distance
+        self.lod_distance = 2.5
+        self.lod_points = []
+        self.culled = 0
+        # Сетки столкновений окна для sweep (см. _collision_window)
+        self._collision = None
         self.sectors = []
         for i in range((radius_render-1)*2+1):
             self.sectors.append([])
@@ -45,11 +689,554 @@ class Planet:
             for j in range((radius_render-1)*2+1):
                 latj = latitude + j - (radius_render-1)
                 nameij = CoordsToName(longi, latj)
-                self.sectors[i].append(SphereSector(radius, math.radians(longi), math.radians(latj), longi, latj, details))
+                self.sectors[i].append(SphereSector(radius, math.radians(longi), math.radians(latj), longi, latj, details, seed, store, self.edges))
+
+    def release_buffers(self):
+        for row in self.sectors:
+            for sector in row:
+                sector.release_buffers()
+        self.cache.clear()
+    
+    def desired_level(self, sector):
+        if not self.lod_points:
+            return 0
+        center = (sector.center_x, sector.center_y, sector.center_z)
+        distance = min(math.dist(center, point) for point in self.lod_points)
+        if distance < self.lod_distance:
+            return 0
+        return int(math.log2(distance / self.lod_distance)) + 1
+    
+    def update_lod(self, points, budget=4):
+        # points - камера и лендер. За кадр меняется уровень не более чем у budget секторов,
+        # начиная с самых далёких от нужного уровня, затем обновляются швы между соседями
+        self.lod_points = [tuple(point) for point in points]
+        changes = []
+        for row in self.sectors:
+            for sector in row:
+                if not sector.ready:
+                    continue
+                level = min(self.desired_level(sector), sector.max_level)
+                if level != sector.level:
+                    changes.append((-abs(level - sector.level), level, sector))
+        changes.sort(key=lambda change: change[:2])
+        for _, level, sector in changes[:budget]:
+            sector.set_level(level)
+        
+        size = len(self.sectors)
+        def neighbour_details(i, j):
+            if 0 <= i < size and 0 <= j < size and self.sectors[i][j].ready:
+                return self.sectors[i][j].lod_details
+            return None
+        for i in range(size):
+            for j in range(size):
+                self.sectors[i][j].set_seams((neighbour_details(i - 1, j), neighbour_details(i + 1, j),
+                                              neighbour_details(i, j - 1), neighbour_details(i, j + 1)))
+        return min(len(changes), budget)
+    
+    def visible_sectors(self, planes, eye):
+        # Сектора, ограничивающая сфера которых пересекает пирамиду видимости и не скрыта за горизонтом.
+        # Горизонт считается по сфере радиуса radius - 2 * TERRAIN_RELIEF, целиком лежащей под рельефом
+        sectors = [sector for row in self.sectors for sector in row]
+        bounds = np.array([sector.bounds for sector in sectors])
+        visible = sphere_visibility(bounds[:, :3], bounds[:, 3], planes, np.asarray(eye, dtype=float), self.radius - 2 * TERRAIN_RELIEF)
+        self.culled = int(len(sectors) - visible.sum())
+        return [sector for sector, keep in zip(sectors, visible.tolist()) if keep]
+    
+    def center_point(self):
+        sector = self.sectors[self.radius_render - 1][self.radius_render - 1]
+        return (sector.center_x, sector.center_y, sector.center_z)
+    
+    def sector_at(self, deg_longitude, deg_latitude):
+        # Сектор, содержащий целые градусы (deg_longitude, deg_latitude), за O(1); None - вне окна
+        i = deg_longitude - (self.longitude - (self.radius_render - 1))
+        j = deg_latitude - (self.latitude - (self.radius_render - 1))
+        if 0 <= i < len(self.sectors) and 0 <= j < len(self.sectors[i]):
+            return self.sectors[i][j]
+        return None
+    
+    def surface_height(self, longitude, latitude):
+        if np.ndim(longitude) == 0 and np.ndim(latitude) == 0:
+            sector = self.sector_at(round(math.degrees(longitude)), round(math.degrees(latitude)))
+            if sector is not None and sector.has_mesh():
+                return sector.sample_height(longitude, latitude)
+            return get_terrain(self.seed).height(self.radius, longitude, latitude)
+        return self.query(longitude, latitude, with_normals=False)
+    
+    def query(self, longitude, latitude, with_normals=True):
+        # Высоты и нормали поверхности для массива точек (радианы). Точки загруженных секторов
+        # интерполируются по готовой сетке, остальные считаются по шуму. Без with_normals - только высоты
+        longitude, latitude = np.broadcast_arrays(np.asarray(longitude, dtype=float), np.asarray(latitude, dtype=float))
+        shape = longitude.shape
+        longitude = longitude.reshape(-1)
+        latitude = latitude.reshape(-1)
+        heights = np.empty(len(longitude))
+        d_lon = np.empty(len(longitude))
+        d_lat = np.empty(len(longitude))
+        
+        deg_lon = np.rint(np.degrees(longitude)).astype(np.int64)
+        deg_lat = np.rint(np.degrees(latitude)).astype(np.int64)
+        size = len(self.sectors)
+        i = deg_lon - (self.longitude - (self.radius_render - 1))
+        j = deg_lat - (self.latitude - (self.radius_render - 1))
+        inside = (i >= 0) & (i < size) & (j >= 0) & (j < size)
+        owner = np.where(inside, i * size + j, -1)
+        fallback = ~inside
+        for cell in np.unique(owner[inside]).tolist():
+            sector = self.sectors[cell // size][cell % size]
+            mask = owner == cell
+            if not sector.has_mesh():
+                fallback |= mask
+                continue
+            if not with_normals:
+                heights[mask] = sector.sample_height(longitude[mask], latitude[mask])
+                continue
+            heights[mask], d_lon[mask], d_lat[mask] = sector.sample_height(longitude[mask], latitude[mask], with_gradient=True)
+        if fallback.any():
+            if not with_normals:
+                heights[fallback] = get_terrain(self.seed).height(self.radius, longitude[fallback], latitude[fallback])
+                return heights.reshape(shape)
+            heights[fallback], d_lon[fallback], d_lat[fallback] = self._noise_gradient(longitude[fallback], latitude[fallback])
+        if not with_normals:
+            return heights.reshape(shape)
+        normals = surface_normals(longitude, latitude, heights, d_lon, d_lat)
+        return heights.reshape(shape), normals.reshape(shape + (3,))
+    
+    def raycast(self, origins, directions, max_distance=np.inf):
+        # Шаг - половина ячейки самой подробной сетки секторов, крутизна - наибольшая по их сеткам
+        grids = [sector.collision_grid() for row in self.sectors for sector in row]
+        slope = max((grid.slope for grid in grids if grid is not None), default=None)
+        return cast_rays(self, math.radians(1) / self.details * self.radius / 2, origins, directions, max_distance, slope)
+    
+    def sweep(self, start, end, offsets):
+        # Непрерывная проверка столкновений за шаг: тетраэдры лендеров (вершины start + offsets, массивы (n, 4, 3))
+        # движутся поступательно от start к end. Вершины тетраэдра проверяются против треугольников секторов,
+        # вершины рельефа - против граней тетраэдра; пересечения ребра с ребром не ищутся. Возвращает время
+        # касания в долях шага (inf - касания нет), точку касания и нормаль поверхности в ней
+        n = len(start)
+        toi = np.full(n, np.inf)
+        points = np.full((n, 3), np.nan)
+        normals = np.full((n, 3), np.nan)
+        corners = start[:, None] + offsets
+        motion = end - start
+        swept = np.concatenate([corners, corners + motion[:, None]], axis=1)
+        radius = np.linalg.norm(swept, axis=2)
+        floor = radius.min(axis=1)
+        # Широкая фаза: лендеры целиком выше самого высокого возможного рельефа не проверяются
+        near = np.flatnonzero(floor <= self.radius + TERRAIN_RELIEF)
+        if len(near) == 0:
+            return toi, points, normals
+        # Узел g общей решётки лежит на g/details - 0.5 градуса (lattice_angles), ячейка g - между узлами g и g+1
+        d = self.details
+        cell_lon = np.floor((np.degrees(np.arctan2(swept[near, :, 2], swept[near, :, 0])) + 0.5) * d).astype(np.int64)
+        cell_lat = np.floor((np.degrees(np.arcsin(np.clip(swept[near, :, 1] / radius[near], -1, 1))) + 0.5) * d).astype(np.int64)
+        lon0, lon1 = cell_lon.min(axis=1), cell_lon.max(axis=1)
+        lat0, lat1 = cell_lat.min(axis=1), cell_lat.max(axis=1)
+        floor = floor[near]
+        # Кандидаты всех лендеров сразу, в два этапа: блоки COLLISION_BLOCK x COLLISION_BLOCK ячеек сектора
+        # по наибольшей высоте блока, затем ячейки уцелевших блоков. Прямоугольники лендеров разного
+        # размера дополняются до наибольшего и маскируются
+        cell_top, block_top, grid_vertices, grid_normals = self._collision_window()
+        size = len(self.sectors)
+        blocks = block_top.shape[1]
+        def block_of(cell):
+            return cell // d * blocks + cell % d // COLLISION_BLOCK
+        block_lon0, block_lat0 = block_of(lon0), block_of(lat0)
+        span_lon = block_of(lon1) - block_lon0 + 1
+        span_lat = block_of(lat1) - block_lat0 + 1
+        owner, bi, bj = np.nonzero((np.arange(span_lat.max())[None, :, None] < span_lat[:, None, None]) &
+                                   (np.arange(span_lon.max())[None, None, :] < span_lon[:, None, None]))
+        block_lat = block_lat0[owner] + bi
+        block_lon = block_lon0[owner] + bj
+        # Сектор окна - как в sector_at; блоки вне окна и целиком ниже лендера отбрасываются
+        column = block_lon // blocks - (self.longitude - (self.radius_render - 1))
+        row = block_lat // blocks - (self.latitude - (self.radius_render - 1))
+        inside = (column >= 0) & (column < size) & (row >= 0) & (row < size)
+        slot = np.where(inside, column * size + row, 0)
+        keep = np.flatnonzero(inside & (block_top[slot, block_lat % blocks, block_lon % blocks] >= floor[owner]))
+        if len(keep) == 0:
+            return toi, points, normals
+        owner, slot, block_lat, block_lon = owner[keep], slot[keep], block_lat[keep], block_lon[keep]
+        # Ячейки блоков: номера в секторе и общие, как у cell_lon/cell_lat
+        offsets = np.arange(COLLISION_BLOCK)
+        i = (block_lat % blocks * COLLISION_BLOCK)[:, None, None] + offsets[None, :, None]
+        j = (block_lon % blocks * COLLISION_BLOCK)[:, None, None] + offsets[None, None, :]
+        lat_cell = (block_lat // blocks * d)[:, None, None] + i
+        lon_cell = (block_lon // blocks * d)[:, None, None] + j
+        block, bi, bj = np.nonzero((i < d) & (j < d) & (lat_cell >= lat0[owner, None, None]) & (lat_cell <= lat1[owner, None, None]) &
+                                   (lon_cell >= lon0[owner, None, None]) & (lon_cell <= lon1[owner, None, None]))
+        owner, slot = owner[block], slot[block]
+        i = block_lat[block] % blocks * COLLISION_BLOCK + bi
+        j = block_lon[block] % blocks * COLLISION_BLOCK + bj
+        keep = np.flatnonzero(cell_top[slot, i, j] >= floor[owner])
+        if len(keep) == 0:
+            return toi, points, normals
+        slot, i, j, owner = slot[keep], i[keep], j[keep], near[owner[keep]]
+        # Ячейка (i, j) - два треугольника, как в grid_indices, и четыре вершины (с повторами у соседних ячеек)
+        a = grid_vertices[slot, i, j]
+        b = grid_vertices[slot, i + 1, j]
+        c = grid_vertices[slot, i, j + 1]
+        triangles = np.concatenate([np.stack([a, b, c], axis=1), np.stack([b, grid_vertices[slot, i + 1, j + 1], c], axis=1)]).astype(float)
+        triangle_owner = np.tile(owner, 2)
+        slot = np.tile(slot, 4)
+        i = np.concatenate([i, i + 1, i, i + 1])
+        j = np.concatenate([j, j, j + 1, j + 1])
+        vertices = grid_vertices[slot, i, j].astype(float)
+        vertex_normals = grid_normals[slot, i, j].astype(float)
+        vertex_owner = np.tile(owner, 4)
+        
+        # Вершина рельефа, движущаяся навстречу, входит в грань тетраэдра в тот же момент
+        by_vertex = ray_triangle(vertices[:, None], -motion[vertex_owner, None], corners[vertex_owner][:, TETRAHEDRON_FACES])
+        k, first, t = _first_hits(vertex_owner, by_vertex.min(axis=1))
+        toi[k] = t
+        points[k] = vertices[first]
+        normals[k] = vertex_normals[first] / np.linalg.norm(vertex_normals[first], axis=1, keepdims=True)
+        # Вершины тетраэдров против треугольников; при равном времени касание вершиной тетраэдра
+        by_corner = ray_triangle(corners[triangle_owner], motion[triangle_owner, None], triangles[:, None])
+        k, first, t = _first_hits(triangle_owner, by_corner.min(axis=1))
+        earlier = t <= toi[k]
+        k, first, t = k[earlier], first[earlier], t[earlier]
+        corner = np.argmin(by_corner[first], axis=1)
+        toi[k] = t
+        points[k] = corners[k, corner] + t[:, None] * motion[k]
+        a, b, c = triangles[first, 0], triangles[first, 1], triangles[first, 2]
+        normal = np.cross(b - a, c - a)
+        normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+        # Наружу от центра планеты
+        normals[k] = normal * np.where(np.einsum('ij,ij->i', normal, points[k]) < 0, -1.0, 1.0)[:, None]
+        return toi, points, normals
+    
+    def _collision_window(self):
+        # Сетки столкновений секторов окна одним массивом для sweep: (сектор окна, строка, столбец), сектор -
+        # i * размер окна + j, как в self.sectors. У секторов без сетки нужной детализации cell_top = -inf;
+        # block_top - наибольшая cell_top блоков COLLISION_BLOCK x COLLISION_BLOCK ячеек (неполные у края).
+        # Пересобирается, только когда меняется сетка хотя бы одного сектора
+        grids = [sector.collision_grid() for row in self.sectors for sector in row]
+        grids = [grid if grid is not None and grid.details == self.details else None for grid in grids]
+        if self._collision is None or any(a is not b for a, b in zip(self._collision[0], grids)):
+            d = self.details
+            blocks = -(-d // COLLISION_BLOCK)
+            cell_top = np.full((len(grids), blocks * COLLISION_BLOCK, blocks * COLLISION_BLOCK), -np.inf, dtype=np.float32)
+            vertices = np.zeros((len(grids), d + 1, d + 1, 3), dtype=np.float32)
+            normals = np.zeros((len(grids), d + 1, d + 1, 3), dtype=np.float32)
+            for s, grid in enumerate(grids):
+                if grid is not None:
+                    cell_top[s, :d, :d] = grid.cell_top
+                    vertices[s] = grid.vertices
+                    normals[s] = grid.normals
+            block_top = cell_top.reshape(len(grids), blocks, COLLISION_BLOCK, blocks, COLLISION_BLOCK).max(axis=(2, 4))
+            self._collision = (grids, cell_top, block_top, vertices, normals)
+        return self._collision[1:]
+    
+    def _noise_gradient(self, longitude, latitude, eps=1e-6):
+        terrain = get_terrain(self.seed)
+        height = terrain.height(self.radius, longitude, latitude)
+        d_lon = (terrain.height(self.radius, longitude + eps, latitude) - terrain.height(self.radius, longitude - eps, latitude)) / (2 * eps)
+        d_lat = (terrain.height(self.radius, longitude, latitude + eps) - terrain.height(self.radius, longitude, latitude - eps)) / (2 * eps)
+        return height, d_lon, d_lat
+    
+    def save_to_file(self, filename=None):
+        if filename is None:
+            filename = f"planet_{CoordsToName(self.longitude, self.latitude)}.bin"
+        try:
+            with open(filename, 'wb') as f:
+                f.write(_PLANET_HEADER.pack(PLANET_MAGIC, TILE_VERSION, self.seed, self.radius, self.details,
+                                            self.longitude, self.latitude, self.radius_render).ljust(TILE_HEADER_SIZE, b"\0"))
+                for row in self.sectors:
+                    for sector in row:
+                        write_tile(f, sector.tile_key(sector.details), sector.load_mesh(sector.details))
+            print(f"Область сохранена в файл: {filename}")
+            return True
+        except Exception as e:
+            print(f"Ошибка при сохранении: {e}")
+            return False
+    
+    @classmethod
+    def load_from_file(cls, filename, store=None):
+        try:
+            with open(filename, 'rb') as f:
+                header = f.read(_PLANET_HEADER.size)
+            if len(header) < _PLANET_HEADER.size:
+                raise ValueError("файл области обрезан")
+            magic, version, seed, radius, details, longitude, latitude, radius_render = _PLANET_HEADER.unpack(header)
+            if magic != PLANET_MAGIC:
+                raise ValueError("не файл области")
+            if version != TILE_VERSION:
+                raise ValueError(f"версия области {version}, ожидалась {TILE_VERSION}")
+            
+            planet = cls(radius_render, longitude, latitude, radius, details, seed, store)
+            offset = TILE_HEADER_SIZE
+            for row in planet.sectors:
+                for _ in row:
+                    (_, _, _, lon, lat), mesh, offset = map_tile(filename, offset)
+                    i = lon - (longitude - (radius_render - 1))
+                    j = lat - (latitude - (radius_render - 1))
+                    planet.sectors[i][j].set_mesh(mesh)
+            
+            print(f"Область загружена из файла: {filename}")
+            return planet
+            
+        except Exception as e:
+            print(f"Ошибка при загрузке: {e}")
+            return None
+
+# Детализация заглушки, которая показывается до готовности сетки сектора
+PLACEHOLDER_DETAILS = 2
+# Самая грубая сетка сектора при понижении уровня детализации
+MIN_LOD_DETAILS = 2
+
+def stitch_seams(vertices, normals, seams):
+    # vertices, normals - сетки (n+1, n+1, 3). На сторонах, где сосед грубее, промежуточные
+    # вершины кладутся на его ребро, чтобы между секторами не было щелей
+    n = vertices.shape[0] - 1
+    for side, neighbour in enumerate(seams):
+        if neighbour is None or neighbour >= n:
+            continue
+        f = n // neighbour
+        k = np.arange(n + 1)
+        a = k // f * f
+        b = np.minimum(a + f, n)
+        t = ((k - a) / f)[:, None]
+        for grid in (vertices, normals):
+            edge = (grid[:, 0], grid[:, n], grid[0, :], grid[n, :])[side]
+            edge[:] = edge[a] * (1 - t) + edge[b] * t
+        # После цикла edge - ребро сетки нормалей
+        edge /= np.linalg.norm(edge, axis=1, keepdims=True)
+
+_grid_indices = {}
+_grid_edges = {}
+_index_buffers = {}
+# Освобождённые буферы вершин (id, размер в байтах): новые сетки заливаются в них вместо glGenBuffers
+_free_buffers = []
+FREE_BUFFERS_MAX = 64
+
+def acquire_buffer(data):
+    # Буфер вершин с данными data: освобождённый того же размера, иначе любой освобождённый, иначе новый
+    for k, (buffer, nbytes) in enumerate(_free_buffers):
+        if nbytes == data.nbytes:
+            del _free_buffers[k]
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            return buffer
+    buffer = _free_buffers.pop()[0] if _free_buffers else glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, buffer)
+    glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    return buffer
+
+def recycle_buffer(buffer, nbytes):
+    _free_buffers.append((buffer, nbytes))
+    if len(_free_buffers) > FREE_BUFFERS_MAX:
+        glDeleteBuffers(1, [_free_buffers.pop(0)[0]])
+
+def grid_indices(details):
+    # Индексы треугольников сетки (details+1)x(details+1), один массив на уровень детализации
+    indices = _grid_indices.get(details)
+    if indices is None:
+        first = (np.arange(details)[:, None] * (details + 1) + np.arange(details)[None, :]).reshape(-1)
+        second = first + details + 1
+        # Два треугольника на квад
+        indices = np.stack([first, second, first + 1, second, second + 1, first + 1], axis=1).reshape(-1).astype(np.uint32)
+        indices.flags.writeable = False
+        _grid_indices[details] = indices
+    return indices
+
+def grid_edges(details):
+    # Пары индексов для GL_LINES: каждое ребро вдоль широты и долготы по одному разу, без диагоналей квадов
+    edges = _grid_edges.get(details)
+    if edges is None:
+        nodes = np.arange((details + 1) ** 2).reshape(details + 1, details + 1)
+        along_lon = np.stack([nodes[:, :-1], nodes[:, 1:]], axis=-1).reshape(-1)
+        along_lat = np.stack([nodes[:-1, :], nodes[1:, :]], axis=-1).reshape(-1)
+        edges = np.concatenate([along_lon, along_lat]).astype(np.uint32)
+        edges.flags.writeable = False
+        _grid_edges[details] = edges
+    return edges
+
+def skirt_indices(details):
+    # Треугольники сетки и юбки узла квадродерева: вершина юбки (details+1)**2 + k висит под k-м узлом края
+    indices = _grid_indices.get(('skirt', details))
+    if indices is None:
+        perimeter = _quad_perimeter(details)
+        top = perimeter
+        following = np.roll(perimeter, -1)
+        bottom = (details + 1) ** 2 + np.arange(len(perimeter))
+        below = np.roll(bottom, -1)
+        skirt = np.stack([top, following, bottom, following, below, bottom], axis=1).reshape(-1)
+        indices = np.concatenate([grid_indices(details), skirt]).astype(np.uint32)
+        indices.flags.writeable = False
+        _grid_indices[('skirt', details)] = indices
+    return indices
+
+def shared_index_buffer(details, edges=False, skirts=False):
+    # Индексный буфер на видеокарте, общий для всех секторов одной детализации:
+    # треугольники, с edges - рёбра каркаса, со skirts - треугольники с юбкой узла квадродерева
+    buffer = _index_buffers.get((details, edges, skirts))
+    if buffer is None:
+        if edges:
+            indices = grid_edges(details)
+        elif skirts:
+            indices = skirt_indices(details)
+        else:
+            indices = grid_indices(details)
+        buffer = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffer)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        _index_buffers[(details, edges, skirts)] = buffer
+    return buffer
+
+def lattice_angles(degree, details, start, stop):
+    # Узлы сеток уровня details образуют общую решётку планеты: узел g лежит на g/details - 0.5 градуса.
+    # Угол зависит только от (g, details), поэтому у всех секторов с этим узлом он совпадает до бита
+    return np.radians((degree * details + np.arange(start, stop)) / details - 0.5)
+
+class SharedEdges:
+    # Высоты у границ секторов, общие для соседей. Решётка уровня details делится на непересекающиеся
+    # части: блок 3x3 вокруг каждого угла, полосы в 3 узла шириной вдоль рёбер и внутренность секторов.
+    # Блоки у границ принадлежат планете и считаются один раз; полосы шире ребра на узел в каждую
+    # сторону, чтобы по ним же считались нормали на шве
+    def __init__(self, radius, seed=0):
+        self.radius = radius
+        self.seed = seed
+        self._blocks = {}
+    
+    def sector_heights(self, deg_lon, deg_lat, details):
+        # Высоты сектора на сетке (details+3)x(details+3): узлы сектора и кольцо за его краем
+        d = details
+        # (ключ, первая строка и столбец в решётке, число строк и столбцов, место в сетке сектора)
+        parts = [
+            (('c', deg_lon, deg_lat, d), deg_lat * d - 1, deg_lon * d - 1, 3, 3, 0, 0),
+            (('c', deg_lon + 1, deg_lat, d), deg_lat * d - 1, deg_lon * d + d - 1, 3, 3, 0, d),
+            (('c', deg_lon, deg_lat + 1, d), deg_lat * d + d - 1, deg_lon * d - 1, 3, 3, d, 0),
+            (('c', deg_lon + 1, deg_lat + 1, d), deg_lat * d + d - 1, deg_lon * d + d - 1, 3, 3, d, d),
+            (('v', deg_lon, deg_lat, d), deg_lat * d + 2, deg_lon * d - 1, d - 3, 3, 3, 0),
+            (('v', deg_lon + 1, deg_lat, d), deg_lat * d + 2, deg_lon * d + d - 1, d - 3, 3, 3, d),
+            (('h', deg_lon, deg_lat, d), deg_lat * d - 1, deg_lon * d + 2, 3, d - 3, 0, 3),
+            (('h', deg_lon, deg_lat + 1, d), deg_lat * d + d - 1, deg_lon * d + 2, 3, d - 3, d, 3),
+            (None, deg_lat * d + 2, deg_lon * d + 2, d - 3, d - 3, 3, 3),
+        ]
+        # Блоки забираются сразу: prune в главном потоке может удалить их из словаря
+        blocks = {part[0]: self._blocks.get(part[0]) for part in parts if part[0] is not None}
+        # Все недостающие части - одним вызовом шума
+        missing = [part for part in parts if blocks.get(part[0]) is None]
+        points = [np.meshgrid(lattice_angles(0, d, lat0, lat0 + rows), lattice_angles(0, d, lon0, lon0 + cols), indexing='ij')
+                  for _, lat0, lon0, rows, cols, _, _ in missing]
+        heights = get_terrain(self.seed).height(self.radius, np.concatenate([lon.ravel() for lat, lon in points]),
+                                                np.concatenate([lat.ravel() for lat, lon in points]))
+        offset = 0
+        for key, _, _, rows, cols, _, _ in missing:
+            block = heights[offset:offset + rows * cols].reshape(rows, cols)
+            offset += rows * cols
+            # Сосед мог посчитать тот же блок в другом потоке - значения совпадают, берётся первый
+            blocks[key] = block if key is None else self._blocks.setdefault(key, block)
+        
+        grid = np.empty((d + 3, d + 3))
+        for key, _, _, rows, cols, row, col in parts:
+            grid[row:row + rows, col:col + cols] = blocks[key]
+        return grid
+    
+    def prune(self, min_lon, max_lon, min_lat, max_lat):
+        # Блоки вне окна секторов планеты больше не нужны
+        for key in list(self._blocks):
+            if not (min_lon <= key[1] <= max_lon + 1 and min_lat <= key[2] <= max_lat + 1):
+                del self._blocks[key]
+
+class TriangleGrid:
+    # Сетка сектора для столкновений: вершины и нормали узлов (строка, столбец) и для каждой ячейки
+    # наибольший радиус её вершин, по которому сразу отбрасываются ячейки ниже лендера (Planet.sweep).
+    # slope - оценка сверху крутизны рельефа сектора (подъём на единицу длины) для cast_rays.
+    # Строится один раз при появлении сетки (SphereSector.set_mesh), массивы - виды на сетку
+    __slots__ = ('details', 'vertices', 'normals', 'cell_top', 'slope')
+    
+    def __init__(self, mesh, details):
+        n = details + 1
+        vertices, normals, heights = mesh_views(mesh)
+        self.details = details
+        self.vertices = vertices.reshape(n, n, 3)
+        self.normals = normals.reshape(n, n, 3)
+        heights = heights.reshape(n, n)
+        self.cell_top = np.maximum(np.maximum(heights[:-1, :-1], heights[:-1, 1:]), np.maximum(heights[1:, :-1], heights[1:, 1:]))
+        # Градиент билинейной ячейки не больше корня из двух от крутизны её рёбер
+        slope = 0.0
+        for rise, chord in ((np.diff(heights, axis=0), np.diff(self.vertices, axis=0)), (np.diff(heights, axis=1), np.diff(self.vertices, axis=1))):
+            rise = np.abs(rise)
+            run = np.sqrt(np.maximum(np.einsum('...i,...i', chord, chord) - rise**2, 1e-12))
+            slope = max(slope, float((rise / run).max()))
+        self.slope = math.sqrt(2) * slope
+
+class SectorCache:
+    # Сектора, вышедшие из окна планеты, вместе с сетками и буферами на видеокарте, чтобы при возврате
+    # лендера не строить их заново. Ключ (долгота, широта, детализация, сид); при превышении max_bytes
+    # (память и видеокарта) вытесняются давно ушедшие, их буферы достаются новым секторам
+    def __init__(self, max_bytes=SECTOR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sectors = {}
+    
+    @staticmethod
+    def key(sector):
+        return (sector.deg_longitude, sector.deg_latitude, sector.details, sector.seed)
+    
+    def __len__(self):
+        return len(self._sectors)
+    
+    def __contains__(self, key):
+        return key in self._sectors
+    
+    def put(self, sector):
+        # Сектор, сетка которого ещё строится, не кэшируется: поток подгрузки отдаст её в свой запас
+        if not sector.ready:
+            sector.release_buffers()
+            return False
+        key = self.key(sector)
+        previous = self._sectors.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[1]
+            if previous[0] is not sector:
+                previous[0].release_buffers()
+        size = sector.get_memory_size() + sector.get_buffer_size()
+        self._sectors[key] = (sector, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            # Первый в словаре - дольше всех лежащий в кэше
+            sector, size = self._sectors.pop(next(iter(self._sectors)))
+            self.bytes -= size
+            sector.release_buffers()
+            self.evictions += 1
+        return key in self._sectors
+    
+    def take(self, key):
+        entry = self._sectors.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes -= entry[1]
+        return entry[0]
+    
+    def clear(self):
+        for sector, _ in self._sectors.values():
+            sector.release_buffers()
+        self._sectors.clear()
+        self.bytes = 0
 
 class SphereSector:
-    def __init__(self, radius=7.0, longitude=0, latitude=0, deg_longitude=0, deg_latitude=0, details=32):
+    __slots__ = ('radius', 'seed', 'store', 'longitude', 'latitude', 'deg_longitude', 'deg_latitude',
+                 'scale_lon', 'scale_lat', 'details', 'sectorName', 'color',
+                 'min_lat', 'max_lat', 'min_lon', 'max_lon', 'center_x', 'center_y', 'center_z',
+                 '_meshes', 'level', 'lod_details', 'max_level', 'seams', 'bounds',
+                 '_vertex_buffer', '_buffer_bytes', 'ready', 'placeholder', 'lat_angles', 'lon_angles', 'edges', '_collision')
+    
+    def __init__(self, radius=7.0, longitude=0, latitude=0, deg_longitude=0, deg_latitude=0, details=32, seed=0, store=None, edges=None):
         self.radius = radius
+        self.seed = seed
+        self.store = store
+        # Общие с соседями узлы у границ (SharedEdges планеты); без них сектор считает их сам
+        self.edges = edges
         self.longitude = longitude
         self.latitude = latitude
         self.deg_longitude = deg_longitude
@@ -67,21 +1254,32 @@ class SphereSector:
         
         self.center_x, self.center_y, self.center_z = self.spherical_to_cartesian(self.longitude, self.latitude, 0.05)
         
-        self._vertices_cache = {}
-        self._normals_cache = {}
-        self._indices_cache = None
+        # Сетки по уровням детализации, каждая - один непрерывный массив float32 (см. mesh_views)
+        self._meshes = {}
+        # Уровень детализации: сетка lod_details = details >> level, швы - детализация соседей
+        self.level = 0
+        self.lod_details = details
+        self.max_level = 0
+        while (details >> (self.max_level + 1)) >= MIN_LOD_DETAILS and (details >> self.max_level) % 2 == 0:
+            self.max_level += 1
+        self.seams = (None, None, None, None)
+        # Ограничивающая сфера (x, y, z, r); до готовности сетки - по максимально возможному рельефу
+        self.bounds = None
+        self._set_bounds(radius - TERRAIN_RELIEF, radius + TERRAIN_RELIEF)
+        # Буфер вершин и нормалей на видеокарте; индексы общие, см. shared_index_buffer
+        self._vertex_buffer = None
+        self._buffer_bytes = 0
+        # Пока сетка строится в фоне, рисуется грубая заглушка
+        self.ready = True
+        self.placeholder = None
+        # Индекс треугольников самой подробной сетки для столкновений (TriangleGrid)
+        self._collision = None
         
         self._setup_geometry()
         
     def _setup_geometry(self):
-        self.lat_angles = [
-            self.min_lat + (i / self.details) * (self.max_lat - self.min_lat) 
-            for i in range(self.details + 1)
-        ]
-        self.lon_angles = [
-            self.min_lon + (i / self.details) * (self.max_lon - self.min_lon) 
-            for i in range(self.details + 1)
-        ]
+        self.lat_angles = lattice_angles(self.deg_latitude, self.details, 0, self.details + 1)
+        self.lon_angles = lattice_angles(self.deg_longitude, self.details, 0, self.details + 1)
     
     def spherical_to_cartesian(self, longitude, latitude, height=0):
         effective_radius = self.radius + height
@@ -91,118 +1289,306 @@ class SphereSector:
         z = effective_radius * cos_lat * math.sin(longitude)
         return (x, y, z)
     
-    def generate_indices(self):
-        if self._indices_cache is not None:
-            return self._indices_cache
-            
-        indices = []
-        longs = self.details
-        for lat in range(self.details):
-            lat_offset = lat * (longs + 1)
-            next_lat_offset = (lat + 1) * (longs + 1)
-            
-            for lon in range(longs):
-                first = lat_offset + lon
-                second = next_lat_offset + lon
-                
-                # Два треугольника на квад
-                indices.extend([first, second, first + 1])
-                indices.extend([second, second + 1, first + 1])
-                
-        self._indices_cache = indices
-        return indices
+    def generate_indices(self, details=None):
+        if details is None:
+            details = self.lod_details
+        return grid_indices(details)
     
-    def get_vertices_and_normals(self):
-        cache_key = CoordsToName(self.deg_longitude, self.deg_latitude)
-        
-        if cache_key in self._vertices_cache:
-            return self._vertices_cache[cache_key], self._normals_cache[cache_key]
+    def tile_key(self, details=None):
+        if details is None:
+            details = self.lod_details
+        return (self.seed, self.radius, details, self.deg_longitude, self.deg_latitude)
+    
+    def get_mesh(self):
+        details = self.lod_details
         
-        vertices = []
-        normals = []
+        if details not in self._meshes:
+            self.set_mesh(self.load_mesh(details))
+        return mesh_views(self._meshes[details])
+    
+    def get_vertices_and_normals(self):
+        vertices, normals, _ = self.get_mesh()
+        return vertices, normals
+    
+    def has_mesh(self):
+        return self.ready and self.lod_details in self._meshes
+    
+    def sample_height(self, longitude, latitude, with_gradient=False):
+        heights = self.get_mesh()[2]
+        step = (self.max_lon - self.min_lon) / self.lod_details
+        return sample_grid(heights, self.lod_details, self.min_lon, self.min_lat, step, longitude, latitude, with_gradient)
+    
+    def load_mesh(self, details=None):
+        # Сетка уровня details: из более подробной в памяти, с диска, уточнением более грубой или генерацией.
+        # Состояние сектора не меняется, поэтому может выполняться в фоновом потоке
+        if details is None:
+            details = self.lod_details
+        finer = [d for d in self._meshes if d > details]
+        if finer:
+            return self._coarsen(min(finer), details)
+        key = self.tile_key(details)
+        mesh = self.store.get(key) if self.store is not None else None
+        if mesh is None and self.store is not None and details < self.details and self.details % details == 0:
+            # Запекается обычно только полный уровень: грубый получается из него и в кэш не пишется
+            finest = self.store.get(self.tile_key(self.details))
+            if finest is not None:
+                return self._coarsen(self.details, details, finest)
+        if mesh is None:
+            coarser = [d for d in self._meshes if d < details]
+            if coarser:
+                mesh = self._refine(max(coarser), details)
+            else:
+                mesh = self.compute_mesh(details)
+            if self.store is not None:
+                self.store.put(key, mesh)
+        return mesh
+    
+    @staticmethod
+    def _grids(mesh, details):
+        n = details + 1
+        vertices, normals, heights = mesh_views(mesh)
+        return vertices.reshape(n, n, 3), normals.reshape(n, n, 3), heights.reshape(n, n)
+    
+    def _coarsen(self, source, details, source_mesh=None):
+        # Узлы грубой сетки - подмножество узлов подробной, шум не пересчитывается.
+        # source_mesh - подробная сетка не из памяти сектора (например, тайл с диска)
+        f = source // details
+        if source_mesh is None:
+            source_mesh = self._meshes[source]
+        mesh = np.empty(7 * (details + 1) ** 2, dtype=np.float32)
+        for target, grid in zip(self._grids(mesh, details), self._grids(source_mesh, source)):
+            target[...] = grid[::f, ::f]
+        self._set_normals(mesh, details)
+        return mesh
+    
+    def _refine(self, source, details):
+        # Узлы грубой сетки переносятся как есть, шум считается только в новых узлах и кольце вокруг сетки
+        f = details // source
+        n = details + 1
+        lat_angles, lon_angles = self._angles(details)
+        latitude, longitude = np.meshgrid(lat_angles, lon_angles, indexing='ij')
+        fresh = np.ones((n, n), dtype=bool)
+        fresh[::f, ::f] = False
+        ring_lon, ring_lat = self._ring_points(details)
+        heights = self.noise_surface(np.concatenate([longitude[fresh], ring_lon]), np.concatenate([latitude[fresh], ring_lat]))
+        count = len(heights) - len(ring_lon)
+        mesh = np.empty(7 * n * n, dtype=np.float32)
+        points = mesh_views(self._pack_points(longitude[fresh], latitude[fresh], heights[:count]))
+        for target, grid, values in zip(self._grids(mesh, details), self._grids(self._meshes[source], source), points):
+            target[::f, ::f] = grid
+            target[fresh] = values
+        self._set_normals(mesh, details, heights[count:])
+        return mesh
+    
+    def _angles(self, details):
+        if details == self.details:
+            return self.lat_angles, self.lon_angles
+        return lattice_angles(self.deg_latitude, details, 0, details + 1), lattice_angles(self.deg_longitude, details, 0, details + 1)
+    
+    def _ring_angles(self, details):
+        # Узлы на шаг сетки за краем сектора - те же точки, что и вторые ряды соседних секторов
+        lat_ring = lattice_angles(self.deg_latitude, details, -1, details + 2)[[0, -1]]
+        lon_ring = lattice_angles(self.deg_longitude, details, -1, details + 2)[[0, -1]]
+        return lat_ring, lon_ring
+    
+    def _ring_points(self, details):
+        # Кольцо без углов: южный и северный ряды, затем западный и восточный столбцы
+        n = details + 1
+        lat_angles, lon_angles = self._angles(details)
+        lat_ring, lon_ring = self._ring_angles(details)
+        longitude = np.concatenate([np.tile(lon_angles, 2), np.tile(lon_ring, n)])
+        latitude = np.concatenate([np.repeat(lat_ring, n), np.repeat(lat_angles, 2)])
+        return longitude, latitude
+    
+    def _pack_points(self, longitude, latitude, heights):
+        cos_lat = np.cos(latitude)
+        sin_lat = np.sin(latitude)
+        cos_lon = np.cos(longitude)
+        sin_lon = np.sin(longitude)
         
-        for latitude in self.lat_angles:
-            sin_lat = math.sin(latitude)
-            cos_lat = math.cos(latitude)
-            
-            for longitude in self.lon_angles:
-                height = self.noise_surface(longitude, latitude)
-                
-                effective_radius = height
-                cos_lon = math.cos(longitude)
-                sin_lon = math.sin(longitude)
-                
-                x = effective_radius * cos_lat * cos_lon
-                y = effective_radius * sin_lat
-                z = effective_radius * cos_lat * sin_lon
-                
-                vertices.append((x, y, z))
-                
-                # Нормаль
-                normal_x = cos_lat * cos_lon
-                normal_y = sin_lat
-                normal_z = cos_lat * sin_lon
-                length = math.sqrt(normal_x*normal_x + normal_y*normal_y + normal_z*normal_z)
-                if length > 0:
-                    normals.append((normal_x/length, normal_y/length, normal_z/length))
-                else:
-                    normals.append((normal_x, normal_y, normal_z))
+        mesh = np.empty(7 * heights.size, dtype=np.float32)
+        vertices, normals, packed_heights = mesh_views(mesh)
+        # Нормаль
+        unit = np.stack([cos_lat * cos_lon, sin_lat, cos_lat * sin_lon], axis=-1).reshape(-1, 3)
+        unit /= np.linalg.norm(unit, axis=1, keepdims=True)
+        normals[...] = unit
+        vertices[...] = unit * heights.reshape(-1, 1)
+        packed_heights[...] = heights.reshape(-1)
+        return mesh
+    
+    def compute_mesh(self, details=None):
+        if details is None:
+            details = self.lod_details
+        lat_angles, lon_angles = self._angles(details)
+        latitude, longitude = np.meshgrid(lat_angles, lon_angles, indexing='ij')
+        if self.edges is not None and details >= 4:
+            # Узлы у границ берутся из общих блоков планеты, шум считается только для остального
+            grid = self.edges.sector_heights(self.deg_longitude, self.deg_latitude, details)
+            heights = grid[1:-1, 1:-1].ravel()
+            ring = np.concatenate([grid[0, 1:-1], grid[-1, 1:-1], grid[1:-1, [0, -1]].ravel()])
+        else:
+            ring_lon, ring_lat = self._ring_points(details)
+            # Сетка и кольцо за её краем - одним вызовом шума
+            heights = self.noise_surface(np.concatenate([longitude.ravel(), ring_lon]), np.concatenate([latitude.ravel(), ring_lat]))
+            heights, ring = heights[:latitude.size], heights[latitude.size:]
+        mesh = self._pack_points(longitude.ravel(), latitude.ravel(), heights)
+        self._set_normals(mesh, details, ring)
+        return mesh
+    
+    def _set_normals(self, mesh, details, ring_heights=None):
+        # Нормали по центральным разностям соседних узлов; высоты кольца за краем совпадают
+        # с узлами соседних секторов, поэтому освещение на швах непрерывно
+        n = details + 1
+        if ring_heights is None:
+            ring_heights = self.noise_surface(*self._ring_points(details))
+        lat_angles, lon_angles = self._angles(details)
+        lat_ring, lon_ring = self._ring_angles(details)
+        latitude = np.concatenate([lat_ring[:1], lat_angles, lat_ring[1:]])
+        longitude = np.concatenate([lon_ring[:1], lon_angles, lon_ring[1:]])
         
-        self._vertices_cache[cache_key] = vertices
-        self._normals_cache[cache_key] = normals
+        vertices, normals, heights = self._grids(mesh, details)
+        # Высоты берутся в точности float32, как в сетке, чтобы нормали не зависели от способа её получения
+        ring_heights = np.asarray(ring_heights, dtype=np.float32)
+        grid = np.empty((n + 2, n + 2))
+        grid[1:-1, 1:-1] = heights
+        grid[[0, -1], 1:-1] = ring_heights[:2 * n].reshape(2, n)
+        grid[1:-1, [0, -1]] = ring_heights[2 * n:].reshape(n, 2)
         
-        return vertices, normals
+        cos_lat = np.cos(latitude)[:, None]
+        points = np.stack([cos_lat * np.cos(longitude), np.broadcast_to(np.sin(latitude)[:, None], grid.shape), cos_lat * np.sin(longitude)], axis=-1)
+        points *= grid[..., None]
+        normal = np.cross(points[2:, 1:-1] - points[:-2, 1:-1], points[1:-1, 2:] - points[1:-1, :-2])
+        length = np.linalg.norm(normal, axis=-1, keepdims=True)
+        # У полюса разность по долготе вырождается - остаётся радиальная нормаль
+        degenerate = length[..., 0] < 1e-12
+        normal[degenerate] = vertices[degenerate] / np.linalg.norm(vertices[degenerate], axis=-1, keepdims=True)
+        length[degenerate] = 1
+        normals[...] = normal / length
+    
+    def _set_bounds(self, min_height, max_height):
+        # Сфера вокруг узлов 3x3 по широте/долготе на минимальной и максимальной высоте;
+        # запас покрывает прогиб дуги между узлами
+        points = []
+        for latitude in (self.min_lat, self.latitude, self.max_lat):
+            for longitude in (self.min_lon, self.longitude, self.max_lon):
+                for height in (min_height, max_height):
+                    points.append(self.spherical_to_cartesian(longitude, latitude, height - self.radius))
+        points = np.array(points)
+        center = points.mean(axis=0)
+        sag = max_height * (1 - math.cos(self.scale_lon / 2))
+        self.bounds = (*center.tolist(), float(np.linalg.norm(points - center, axis=1).max()) + sag)
+    
+    def set_mesh(self, mesh):
+        details = math.isqrt(len(mesh) // 7) - 1
+        self._meshes[details] = mesh
+        heights = mesh_views(mesh)[2]
+        if details == self.lod_details:
+            self._set_bounds(float(heights.min()), float(heights.max()))
+        if self._collision is None or details > self._collision.details:
+            self._collision = TriangleGrid(mesh, details)
+        self.ready = True
+        if self.placeholder is not None:
+            self.placeholder.release_buffers()
+            self.placeholder = None
+    
+    def collision_grid(self):
+        # None, пока сетка сектора строится
+        return self._collision if self.ready else None
+    
+    def set_level(self, level):
+        level = max(0, min(level, self.max_level))
+        if level == self.level:
+            return False
+        self.level = level
+        self.lod_details = self.details >> level
+        self._release_own_buffers()
+        return True
+    
+    def set_seams(self, seams):
+        # seams - детализация соседей (запад, восток, юг, север); None - соседа нет
+        if seams != self.seams:
+            self.seams = seams
+            self._release_own_buffers()
+    
+    def make_placeholder(self):
+        self.ready = False
+        self.placeholder = SphereSector(self.radius, self.longitude, self.latitude, self.deg_longitude, self.deg_latitude, PLACEHOLDER_DETAILS, self.seed)
     
     def noise_surface(self, longitude, latitude):
-        noise = PerlinNoise(octaves=2, seed=4522)
-        noise2 = PerlinNoise(octaves=3, seed=345)
-        noise3 = PerlinNoise(octaves=3, seed=235)
-        return self.radius + 0.03 * noise([longitude*5, latitude*5]) + 0.03 * noise2([longitude*20, latitude*20]) + 0.01 * noise3([longitude*80, latitude*80])
+        return get_terrain(self.seed).height(self.radius, longitude, latitude)
 
-    def draw_solid(self):
-        vertices, normals = self.get_vertices_and_normals()
-        indices = self.generate_indices()
+    def upload_buffers(self):
+        if self._vertex_buffer is not None:
+            return
+        self.get_mesh()
+        # Вершины и нормали уже лежат подряд в массиве сетки; копия нужна только для сшивки швов
+        side = self.lod_details + 1
+        data = self._meshes[self.lod_details][:6 * side * side]
+        if any(neighbour is not None and neighbour < self.lod_details for neighbour in self.seams):
+            data = np.array(data)
+            stitch_seams(data[:3 * side * side].reshape(side, side, 3), data[3 * side * side:].reshape(side, side, 3), self.seams)
         
-        glBegin(GL_TRIANGLES)
-        for i in indices:
-            vx, vy, vz = vertices[i]
-            nx, ny, nz = normals[i]
-            glNormal3f(nx, ny, nz)
-            glVertex3f(vx, vy, vz)
-        glEnd()
+        self._vertex_buffer = acquire_buffer(data)
+        self._buffer_bytes = data.nbytes
+    
+    def release_buffers(self):
+        if self.placeholder is not None:
+            self.placeholder.release_buffers()
+        self._release_own_buffers()
+    
+    def _release_own_buffers(self):
+        if self._vertex_buffer is None:
+            return
+        recycle_buffer(self._vertex_buffer, self._buffer_bytes)
+        self._vertex_buffer = None
+        self._buffer_bytes = 0
+    
+    def _draw_elements(self, with_normals):
+        self.upload_buffers()
+        n = (self.lod_details + 1) ** 2
+        glBindBuffer(GL_ARRAY_BUFFER, self._vertex_buffer)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+        if with_normals:
+            glEnableClientState(GL_NORMAL_ARRAY)
+            glNormalPointer(GL_FLOAT, 0, ctypes.c_void_p(3 * 4 * n))
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, shared_index_buffer(self.lod_details))
+            glDrawElements(GL_TRIANGLES, 6 * self.lod_details ** 2, GL_UNSIGNED_INT, None)
+        else:
+            # Каркас: каждое ребро сетки одной линией
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, shared_index_buffer(self.lod_details, edges=True))
+            glDrawElements(GL_LINES, 4 * self.lod_details * (self.lod_details + 1), GL_UNSIGNED_INT, None)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        if with_normals:
+            glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+    
+    def draw_solid(self):
+        self._draw_elements(with_normals=True)
     
     def draw_wireframe(self):
-        vertices, _ = self.get_vertices_and_normals()
-        indices = self.generate_indices()
-        
         glDisable(GL_LIGHTING)
         glColor3f(self.color, self.color, self.color)
-        
-        glBegin(GL_LINES)
-        for i in range(0, len(indices), 3):
-            # Первый треугольник
-            v1 = vertices[indices[i]]
-            v2 = vertices[indices[i+1]]
-            v3 = vertices[indices[i+2]]
-            
-            # Рёбра треугольника
-            glVertex3f(*v1)
-            glVertex3f(*v2)
-            
-            glVertex3f(*v2)
-            glVertex3f(*v3)
-            
-            glVertex3f(*v3)
-            glVertex3f(*v1)
-        glEnd()
-        
+        self._draw_elements(with_normals=False)
         glEnable(GL_LIGHTING)
     
+    def prepare(self):
+        # Сетка и буфер на видеокарте заранее, чтобы построение не смешивалось с вызовами рисования
+        if not self.ready:
+            self.placeholder.upload_buffers()
+        else:
+            self.upload_buffers()
+    
     def draw_optimized(self, wireframe=False):
+        # Возвращает число нарисованных линий или треугольников
+        if not self.ready:
+            return self.placeholder.draw_optimized(wireframe)
         if wireframe:
             self.draw_wireframe()
-        else:
-            self.draw_solid()
+            return 2 * self.lod_details * (self.lod_details + 1)
+        self.draw_solid()
+        return 2 * self.lod_details ** 2
     
     def get_sector_info(self):
         lat_deg_min = math.degrees(self.min_lat)
@@ -221,22 +1607,10 @@ class SphereSector:
     def save_to_file(self, filename=None):
         if filename is None:
             filename = f"{self.sectorName}.bin"
-        data = {
-            'radius': self.radius,
-            'details': self.details,
-            'sectorName': self.sectorName,
-            'longitude': self.longitude,
-            'latitude': self.latitude,
-            'scale_lon': self.scale_lon,
-            'scale_lat': self.scale_lat,
-            'vertices_cache': self._vertices_cache,
-            'normals_cache': self._normals_cache,
-            'indices_cache': self._indices_cache
-        }
         
         try:
             with open(filename, 'wb') as f:
-                pickle.dump(data, f)
+                write_tile(f, self.tile_key(self.details), self.load_mesh(self.details))
             print(f"Сектор '{self.sectorName}' сохранен в файл: {filename}")
             return True
         except Exception as e:
@@ -244,24 +1618,12 @@ class SphereSector:
             return False
     
     @classmethod
-    def load_from_file(cls, filename):
+    def load_from_file(cls, filename, store=None):
         try:
-            with open(filename, 'rb') as f:
-                data = pickle.load(f)
+            (seed, radius, details, lon, lat), mesh, _ = map_tile(filename)
             
-            sector = cls(
-                radius=data['radius'],
-                longitude=data['longitude'],
-                latitude=data['latitude'],
-                scale_lon=data['scale_lon'],
-                scale_lat=data['scale_lat'],
-                details=data['details'],
-                sectorName=data['sectorName']
-            )
-            
-            sector._vertices_cache = data.get('vertices_cache', {})
-            sector._normals_cache = data.get('normals_cache', {})
-            sector._indices_cache = data.get('indices_cache', None)
+            sector = cls(radius, math.radians(lon), math.radians(lat), lon, lat, details, seed, store)
+            sector.set_mesh(mesh)
             
             print(f"Сектор '{sector.sectorName}' загружен из файла: {filename}")
             return sector
@@ -271,43 +1633,635 @@ class SphereSector:
             return None
     
     def get_save_data_size(self):
-        data = {
-            'radius': self.radius,
-            'longitude': self.longitude,
-            'latitude': self.latitude,
-            'sectorName': self.sectorName,
-            'scale_lat': self.scale_lat,
-            'scale_lon': self.scale_lon,
-            'details': self.details,
-            'vertices_cache': self._vertices_cache,
-            'normals_cache': self._normals_cache,
-            'indices_cache': self._indices_cache
+        return tile_size(self.details)
+    
+    def get_memory_size(self):
+        # Байты в памяти: сам объект и массивы сеток всех уровней (общие индексы не учитываются)
+        return sys.getsizeof(self) + sum(mesh.nbytes for mesh in self._meshes.values())
+    
+    def get_buffer_size(self):
+        # Байты на видеокарте, включая заглушку
+        placeholder = self.placeholder.get_buffer_size() if self.placeholder is not None else 0
+        return self._buffer_bytes + placeholder
+
+# Грани куба для квадродерева: нормаль, ось u (столбцы сетки узла) и ось v (строки).
+# cross(v, u) = нормаль - тот же обход треугольников, что у секторов
+CUBE_FACES = (((1, 0, 0), (0, 0, 1), (0, 1, 0)), ((-1, 0, 0), (0, 0, -1), (0, 1, 0)),
+              ((0, 1, 0), (0, 0, 1), (-1, 0, 0)), ((0, -1, 0), (0, 0, 1), (1, 0, 0)),
+              ((0, 0, 1), (-1, 0, 0), (0, 1, 0)), ((0, 0, -1), (1, 0, 0), (0, 1, 0)))
+_CUBE_AXES = np.array(CUBE_FACES, dtype=float)
+# Самый глубокий уровень: ячейка узла с детализацией 8 - около 0.01°, мельче самых мелких деталей шума.
+# У полюсов и на долготе 180° шум по (долгота, широта) разрывен, и там ошибка с уровнем не убывает
+QUADTREE_MAX_LEVEL = 10
+
+def cube_directions(face, a, b):
+    # Единичные направления для параметров грани a (вдоль u) и b (вдоль v) из [-1, 1].
+    # Параметр пропорционален углу, а не координате на кубе: ячейки у углов граней
+    # не мельче центральных больше чем в ~1.4 раза (на самом кубе - в ~5 раз)
+    normal, u, v = _CUBE_AXES[face]
+    s = np.tan(np.asarray(a, dtype=float) * (math.pi / 4))[..., None]
+    t = np.tan(np.asarray(b, dtype=float) * (math.pi / 4))[..., None]
+    directions = normal + s * u + t * v
+    return directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+def cube_face_coords(directions):
+    # Обратное к cube_directions: грань и параметры (a, b) для массива направлений (..., 3)
+    face = np.argmax(directions @ _CUBE_AXES[:, 0].T, axis=-1)
+    axes = _CUBE_AXES[face]
+    along = np.einsum('...k,...k->...', directions, axes[..., 0, :])
+    a = np.arctan(np.einsum('...k,...k->...', directions, axes[..., 1, :]) / along) * (4 / math.pi)
+    b = np.arctan(np.einsum('...k,...k->...', directions, axes[..., 2, :]) / along) * (4 / math.pi)
+    return face, a, b
+
+def _quad_perimeter(details):
+    # Узлы края сетки узла по кругу: нижняя строка, правый столбец, верхняя строка, левый столбец
+    n = details + 1
+    k = np.arange(details)
+    return np.concatenate([k, k * n + details, details * n + details - k, (details - k) * n])
+
+class QuadNode:
+    # Узел квадродерева на грани куба: квадрат [min_a, min_a + size] x [min_b, min_b + size] в параметрах грани,
+    # сетка (details+1)x(details+1) в формате mesh_views и юбка из 4*details вершин под краем,
+    # закрывающая щели между соседями разных уровней
+    __slots__ = ('radius', 'seed', 'face', 'level', 'i', 'j', 'details', 'min_a', 'min_b', 'size', 'step',
+                 'color', 'children', 'mesh', 'error', 'bounds', 'used', '_vertex_buffer')
+    
+    def __init__(self, radius, seed, face, level, i, j, details):
+        self.radius = radius
+        self.seed = seed
+        self.face = face
+        self.level = level
+        self.i = i
+        self.j = j
+        self.details = details
+        self.size = 2 / 2 ** level
+        self.min_a = -1 + i * self.size
+        self.min_b = -1 + j * self.size
+        self.step = self.size / details
+        self.color = 0.9 + 0.05 * math.pow(-1, i + j)
+        self.children = None
+        self.mesh = None
+        # Оценка отклонения сетки от рельефа; известна, когда сетка построена
+        self.error = None
+        self.used = 0
+        self._vertex_buffer = None
+        # До готовности сетки - сфера по максимально возможному рельефу
+        k = np.linspace(0, 1, 5)
+        b, a = np.meshgrid(self.min_b + k * self.size, self.min_a + k * self.size, indexing='ij')
+        directions = cube_directions(face, a, b).reshape(-1, 3)
+        self._set_bounds(np.concatenate([directions * (radius - TERRAIN_RELIEF), directions * (radius + TERRAIN_RELIEF)]),
+                         (radius + TERRAIN_RELIEF) * (1 - math.cos(self.size * math.pi / 32)))
+    
+    def _set_bounds(self, points, margin=0.0):
+        center = points.mean(axis=0)
+        self.bounds = (*center.tolist(), float(np.linalg.norm(points - center, axis=1).max()) + margin)
+    
+    def split(self):
+        # Четыре дочерних узла без сеток; порядок - 2 * (верхняя половина по b) + (правая половина по a)
+        if self.children is None:
+            self.children = [QuadNode(self.radius, self.seed, self.face, self.level + 1, 2 * self.i + di, 2 * self.j + dj, self.details)
+                             for dj in (0, 1) for di in (0, 1)]
+        return self.children
+    
+    def collapse(self):
+        if self.children is None:
+            return
+        for child in self.children:
+            child.collapse()
+            child.release_buffers()
+        self.children = None
+    
+    def load_mesh(self):
+        # Сетка с кольцом узлов за краем для нормалей; состояние узла не меняется, можно в фоновом потоке
+        d = self.details
+        k = np.arange(-1, d + 2)
+        b, a = np.meshgrid(self.min_b + k * self.step, self.min_a + k * self.step, indexing='ij')
+        directions = cube_directions(self.face, a, b)
+        longitude = np.arctan2(directions[..., 2], directions[..., 0])
+        latitude = np.arcsin(np.clip(directions[..., 1], -1, 1))
+        heights = get_terrain(self.seed).height(self.radius, longitude, latitude).astype(np.float32)
+        points = directions * heights[..., None]
+        normal = np.cross(points[2:, 1:-1] - points[:-2, 1:-1], points[1:-1, 2:] - points[1:-1, :-2])
+        normal /= np.linalg.norm(normal, axis=-1, keepdims=True)
+        
+        n = (d + 1) ** 2
+        perimeter = _quad_perimeter(d)
+        mesh = np.empty(7 * (n + len(perimeter)), dtype=np.float32)
+        vertices, normals, packed_heights = mesh_views(mesh)
+        vertices[:n] = points[1:-1, 1:-1].reshape(-1, 3)
+        normals[:n] = normal.reshape(-1, 3)
+        packed_heights[:n] = heights[1:-1, 1:-1].reshape(-1)
+        # Юбка: край, опущенный вниз на несколько шагов сетки
+        depth = 4 * self.step * (math.pi / 4) * self.radius
+        edge_heights = packed_heights[perimeter]
+        vertices[n:] = vertices[perimeter] * ((edge_heights - depth) / edge_heights)[:, None]
+        normals[n:] = normals[perimeter]
+        packed_heights[n:] = edge_heights - depth
+        return mesh
+    
+    def set_mesh(self, mesh):
+        self.mesh = mesh
+        vertices, _, heights = mesh_views(mesh)
+        self._set_bounds(vertices)
+        # Ошибка сетки оценивается по тому, насколько от неё отличается сетка вдвое реже;
+        # к ней добавляется прогиб хорды ячейки относительно сферы
+        n = self.details + 1
+        grid = heights[:n * n].reshape(n, n).astype(float)
+        coarse = np.empty_like(grid)
+        coarse[::2, ::2] = grid[::2, ::2]
+        coarse[1::2, ::2] = (grid[:-2:2, ::2] + grid[2::2, ::2]) / 2
+        coarse[:, 1::2] = (coarse[:, :-2:2] + coarse[:, 2::2]) / 2
+        sag = float(grid.max()) * (1 - math.cos(self.step * math.pi / 8))
+        self.error = float(np.abs(grid - coarse).max()) / 2 + sag
+    
+    def sample(self, a, b, with_normals=True):
+        # Высоты и нормали в точках (a, b) узла билинейной интерполяцией по сетке
+        vertices, normals, heights = mesh_views(self.mesh)
+        n = (self.details + 1) ** 2
+        height = sample_grid(heights[:n], self.details, self.min_a, self.min_b, self.step, a, b)
+        if not with_normals:
+            return height
+        normal = np.stack([sample_grid(np.ascontiguousarray(normals[:n, k]), self.details, self.min_a, self.min_b, self.step, a, b)
+                           for k in range(3)], axis=-1)
+        return height, normal / np.linalg.norm(normal, axis=-1, keepdims=True)
+    
+    def upload_buffers(self):
+        if self._vertex_buffer is None:
+            self._vertex_buffer = acquire_buffer(self.mesh[:6 * (len(self.mesh) // 7)])
+    
+    def release_buffers(self):
+        if self._vertex_buffer is None:
+            return
+        recycle_buffer(self._vertex_buffer, 4 * 6 * (len(self.mesh) // 7))
+        self._vertex_buffer = None
+    
+    def prepare(self):
+        self.upload_buffers()
+    
+    def draw_optimized(self, wireframe=False):
+        # Возвращает число нарисованных линий или треугольников; в каркасе юбка не рисуется
+        self.upload_buffers()
+        d = self.details
+        glBindBuffer(GL_ARRAY_BUFFER, self._vertex_buffer)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+        if wireframe:
+            glDisable(GL_LIGHTING)
+            glColor3f(self.color, self.color, self.color)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, shared_index_buffer(d, edges=True))
+            glDrawElements(GL_LINES, 4 * d * (d + 1), GL_UNSIGNED_INT, None)
+            glEnable(GL_LIGHTING)
+            count = 2 * d * (d + 1)
+        else:
+            glEnableClientState(GL_NORMAL_ARRAY)
+            glNormalPointer(GL_FLOAT, 0, ctypes.c_void_p(3 * 4 * (len(self.mesh) // 7)))
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, shared_index_buffer(d, skirts=True))
+            glDrawElements(GL_TRIANGLES, 6 * d * d + 24 * d, GL_UNSIGNED_INT, None)
+            glDisableClientState(GL_NORMAL_ARRAY)
+            count = 2 * d * d + 8 * d
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        return count
+
+class QuadtreePlanet:
+    # Вся планета как шесть квадродеревьев на гранях куба (--quadtree) вместо окна секторов 1°x1°.
+    # Узел делится, пока его ошибка на экране больше max_error пикселей, а ячейки сетки - больше min_cell
+    # пикселей, поэтому плотность треугольников на экране примерно одинакова по всему шару, а работа
+    # за кадр зависит от того, что видно, а не от радиуса прорисовки. Аргументы - как у Planet;
+    # radius_render не используется
+    def __init__(self, radius_render=1, longitude=0, latitude=0, radius=7, details=32, seed=0, store=None,
+                 max_error=2.0, min_cell=4.0, max_level=QUADTREE_MAX_LEVEL, keep_frames=120):
+        self.radius_render = radius_render
+        self.longitude = longitude
+        self.latitude = latitude
+        self.radius = radius
+        # Оценка ошибки узла сравнивает сетку с вдвое более редкой, поэтому детализация чётная
+        self.details = max(2, details + details % 2)
+        self.seed = seed
+        self.store = store
+        self.max_error = max_error
+        self.min_cell = min_cell
+        self.max_level = max_level
+        # Поддерево, не нужное keep_frames кадров подряд, удаляется
+        self.keep_frames = keep_frames
+        # Пикселей на единицу длины на расстоянии 1 при высоте окна 600
+        self.pixel_scale = 600 / (2 * math.tan(math.radians(SectorCamera.fov) / 2))
+        self.frame = 0
+        self.culled = 0
+        # Самый глубокий уровень среди нарисованных узлов, по нему выбирается шаг raycast
+        self.depth = 0
+        self.requested = []
+        self.building = {}
+        self.build_time = 0.0
+        self.roots = [QuadNode(radius, seed, face, 0, 0, 0, self.details) for face in range(6)]
+        for node in self.roots:
+            node.set_mesh(node.load_mesh())
+    
+    def nodes(self):
+        stack = list(self.roots)
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children is not None:
+                stack.extend(node.children)
+    
+    def release_buffers(self):
+        for node in self.nodes():
+            node.release_buffers()
+    
+    def center_point(self):
+        cos_lat = math.cos(math.radians(self.latitude))
+        r = self.radius + 0.05
+        return (r * cos_lat * math.cos(math.radians(self.longitude)), r * math.sin(math.radians(self.latitude)),
+                r * cos_lat * math.sin(math.radians(self.longitude)))
+    
+    def update_lod(self, points, budget=8, executor=None):
+        # Сетки узлов, запрошенных последним visible_sectors, ближние к камере первыми. С executor строятся
+        # в фоне, не больше budget одновременно, без него - сразу, не больше budget за вызов.
+        # points не нужны: деление зависит от ошибки на экране, см. visible_sectors
+        built = 0
+        self.build_time = 0.0
+        for node, future in list(self.building.items()):
+            if future.done():
+                del self.building[node]
+                mesh, elapsed = future.result()
+                node.set_mesh(mesh)
+                self.build_time += elapsed
+                built += 1
+        for node in self.requested:
+            if node.mesh is not None or node in self.building:
+                continue
+            if executor is not None:
+                if len(self.building) >= budget:
+                    break
+                self.building[node] = executor.submit(_build_mesh, node)
+            else:
+                if built >= budget:
+                    break
+                mesh, elapsed = _build_mesh(node)
+                node.set_mesh(mesh)
+                self.build_time += elapsed
+                built += 1
+        return built
+    
+    def _expire(self, node):
+        if node.children is not None and self.frame - node.used > self.keep_frames:
+            node.collapse()
+    
+    def visible_sectors(self, planes, eye):
+        # Обход деревьев по уровням. Видимый узел делится, если его ошибка на экране больше max_error
+        # и сетки всех детей готовы; иначе рисуется он сам, а недостающие дети ставятся в очередь
+        self.frame += 1
+        eye = np.asarray(eye, dtype=float)
+        occluder = self.radius - 2 * TERRAIN_RELIEF
+        drawn = []
+        requested = []
+        self.culled = 0
+        frontier = self.roots
+        while frontier:
+            bounds = np.array([node.bounds for node in frontier])
+            visible = sphere_visibility(bounds[:, :3], bounds[:, 3], planes, eye, occluder)
+            distance = np.maximum(np.linalg.norm(bounds[:, :3] - eye, axis=1) - bounds[:, 3], SectorCamera.near)
+            errors = np.array([node.error for node in frontier])
+            # Вторая проверка нужна у полюсов, где ошибка с уровнем не убывает (см. QUADTREE_MAX_LEVEL)
+            cells = np.array([node.step for node in frontier]) * (math.pi / 4 * self.radius)
+            coarse = (errors * self.pixel_scale / distance > self.max_error) & (cells * self.pixel_scale / distance > self.min_cell)
+            next_frontier = []
+            for node, keep, split, d in zip(frontier, visible.tolist(), coarse.tolist(), distance.tolist()):
+                if not keep:
+                    self.culled += 1
+                    self._expire(node)
+                    continue
+                if split and node.level < self.max_level:
+                    node.used = self.frame
+                    children = node.split()
+                    waiting = [child for child in children if child.mesh is None]
+                    if not waiting:
+                        next_frontier.extend(children)
+                        continue
+                    requested.extend((d, child.level, id(child), child) for child in waiting)
+                else:
+                    self._expire(node)
+                drawn.append(node)
+            frontier = next_frontier
+        requested.sort()
+        self.requested = [item[-1] for item in requested]
+        self.depth = max((node.level for node in drawn), default=0)
+        return drawn
+    
+    def _leaf(self, face, a, b):
+        # Самый подробный узел с готовой сеткой, содержащий точку грани; O(глубины дерева)
+        node = self.roots[face]
+        while node.children is not None and all(child.mesh is not None for child in node.children):
+            middle_a = node.min_a + node.size / 2
+            middle_b = node.min_b + node.size / 2
+            node = node.children[2 * (b >= middle_b) + (a >= middle_a)]
+        return node
+    
+    def node_at(self, longitude, latitude):
+        # Узел под одной точкой и её координаты на грани
+        cos_lat = math.cos(latitude)
+        face, a, b = cube_face_coords(np.array([cos_lat * math.cos(longitude), math.sin(latitude), cos_lat * math.sin(longitude)]))
+        a, b = float(a), float(b)
+        return self._leaf(int(face), a, b), a, b
+    
+    def surface_height(self, longitude, latitude):
+        if np.ndim(longitude) == 0 and np.ndim(latitude) == 0:
+            node, a, b = self.node_at(longitude, latitude)
+            return float(node.sample(a, b, with_normals=False))
+        return self.query(longitude, latitude, with_normals=False)
+    
+    def query(self, longitude, latitude, with_normals=True):
+        # Высоты и нормали для массива точек (радианы) по самым подробным готовым узлам.
+        # Точки спускаются по деревьям группами: на каждом узле - одна раскладка по четвертям
+        longitude, latitude = np.broadcast_arrays(np.asarray(longitude, dtype=float), np.asarray(latitude, dtype=float))
+        shape = longitude.shape
+        longitude = longitude.reshape(-1)
+        latitude = latitude.reshape(-1)
+        cos_lat = np.cos(latitude)
+        face, a, b = cube_face_coords(np.stack([cos_lat * np.cos(longitude), np.sin(latitude), cos_lat * np.sin(longitude)], axis=-1))
+        heights = np.empty(len(longitude))
+        normals = np.empty((len(longitude), 3))
+        stack = [(self.roots[f], np.flatnonzero(face == f)) for f in range(6)]
+        while stack:
+            node, index = stack.pop()
+            if len(index) == 0:
+                continue
+            if node.children is not None and all(child.mesh is not None for child in node.children):
+                quarter = 2 * (b[index] >= node.min_b + node.size / 2) + (a[index] >= node.min_a + node.size / 2)
+                stack.extend((child, index[quarter == k]) for k, child in enumerate(node.children))
+                continue
+            if not with_normals:
+                heights[index] = node.sample(a[index], b[index], with_normals=False)
+                continue
+            heights[index], normals[index] = node.sample(a[index], b[index])
+        if not with_normals:
+            return heights.reshape(shape)
+        return heights.reshape(shape), normals.reshape(shape + (3,))
+    
+    def raycast(self, origins, directions, max_distance=np.inf):
+        # Шаг - половина ячейки самого глубокого нарисованного уровня
+        return cast_rays(self, math.pi / 2 / 2**self.depth / self.details * self.radius / 2, origins, directions, max_distance)
+    
+    def save_to_file(self, filename=None):
+        print("Сохранение области квадродерева не поддерживается")
+        return False
+
+# Ускорение свободного падения у поверхности на единицу радиуса планеты
+SURFACE_GRAVITY = 0.01
+
+def local_frame(longitude, latitude):
+    # Единичные векторы вверх, на восток и на север в точках (радианы)
+    cos_lat = np.cos(latitude)
+    sin_lat = np.sin(latitude)
+    cos_lon = np.cos(longitude)
+    sin_lon = np.sin(longitude)
+    zero = np.zeros_like(cos_lat)
+    up = np.stack([cos_lat * cos_lon, sin_lat, cos_lat * sin_lon], axis=-1)
+    east = np.stack([-sin_lon, zero, cos_lon], axis=-1)
+    north = np.stack([-sin_lat * cos_lon, cos_lat, -sin_lat * sin_lon], axis=-1)
+    return up, east, north
+
+# Тетраэдр лендера в долях размера, в локальном базисе (восток, вверх, север), и его грани
+TETRAHEDRON = np.array([(0, 1, 0), (-1, -1, -1), (1, -1, -1), (0, -1, 1)], dtype=float)
+TETRAHEDRON_FACES = np.array([(0, 1, 2), (0, 2, 3), (0, 3, 1), (1, 3, 2)])
+
+def lander_offsets(longitude, latitude, size):
+    # Вершины тетраэдров относительно центров лендеров, (n, 4, 3)
+    up, east, north = local_frame(longitude, latitude)
+    return np.asarray(size, dtype=float)[..., None, None] * (TETRAHEDRON @ np.stack([east, up, north], axis=-2))
+
+def _first_hits(owner, times):
+    # Для каждого лендера owner - строка с наименьшим конечным times: (лендеры, строки, времена)
+    order = np.lexsort((times, owner))
+    _, first = np.unique(owner[order], return_index=True)
+    first = order[first]
+    first = first[np.isfinite(times[first])]
+    return owner[first], first, times[first]
+
+class LanderFleet:
+    # Состояние всех лендеров в массивах: декартовы положение и скорость, масса, тяга (вверх, восток, север).
+    # Физика идёт фиксированным шагом step независимо от частоты кадров; для отрисовки положение
+    # интерполируется между двумя последними шагами
+    def __init__(self, radius, step=1/120, gravity=None, capacity=16):
+        self.radius = radius
+        self.step = step
+        self.gravity = gravity
+        self.max_steps = 16
+        self.count = 0
+        self.time = 0.0
+        self.accumulator = 0.0
+        # TrajectoryRecorder, получает состояние после каждого шага
+        self.recorder = None
+        # Планета с методом sweep для непрерывной проверки касания тетраэдром; без неё касание -
+        # центр лендера ниже surface_height в конце шага
+        self.collider = None
+        # Номера лендеров, севших на последнем шаге; время касания может быть внутри шага
+        self.just_landed = np.zeros(0, dtype=int)
+        self._allocate(capacity)
+    
+    def _allocate(self, capacity):
+        old = getattr(self, 'position', None)
+        arrays = {
+            'position': np.zeros((capacity, 3)),
+            'previous': np.zeros((capacity, 3)),
+            'velocity': np.zeros((capacity, 3)),
+            'thrust': np.zeros((capacity, 3)),
+            'mass': np.ones(capacity),
+            'size': np.zeros(capacity),
+            'lon': np.zeros(capacity),
+            'lat': np.zeros(capacity),
+            'heig': np.zeros(capacity),
+            'surface': np.zeros(capacity),
+            'touchdown_time': np.full(capacity, np.nan),
+            'touchdown_speed': np.zeros(capacity),
+            'contact_point': np.full((capacity, 3), np.nan),
+            'contact_normal': np.full((capacity, 3), np.nan),
+            'active': np.zeros(capacity, dtype=bool),
+            'landed': np.zeros(capacity, dtype=bool),
         }
-        return len(pickle.dumps(data))
+        for name, array in arrays.items():
+            if old is not None:
+                array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+    
+    def surface_gravity(self):
+        return SURFACE_GRAVITY * self.radius if self.gravity is None else self.gravity
+    
+    def spawn(self, lon, lat, heig, v_lon=0, v_lat=0, v_heig=0, size=0.1, mass=1.0, thrust=(0, 0, 0)):
+        # Аргументы - числа или массивы одной длины; скорости по долготе и широте угловые.
+        # Возвращает индексы новых лендеров
+        lon, lat, heig, v_lon, v_lat, v_heig, size, mass = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(value, dtype=float)) for value in (lon, lat, heig, v_lon, v_lat, v_heig, size, mass)))
+        n = len(lon)
+        if self.count + n > len(self.mass):
+            self._allocate(max(2 * len(self.mass), self.count + n))
+        index = np.arange(self.count, self.count + n)
+        self.count += n
+        
+        up, east, north = local_frame(lon, lat)
+        self.position[index] = up * heig[:, None]
+        self.previous[index] = self.position[index]
+        self.velocity[index] = up * v_heig[:, None] + east * (heig * np.cos(lat) * v_lon)[:, None] + north * (heig * v_lat)[:, None]
+        self.thrust[index] = thrust
+        self.mass[index] = mass
+        self.size[index] = size
+        self.lon[index] = lon
+        self.lat[index] = lat
+        self.heig[index] = heig
+        self.surface[index] = np.nan
+        self.touchdown_time[index] = np.nan
+        self.touchdown_speed[index] = 0
+        self.contact_point[index] = np.nan
+        self.contact_normal[index] = np.nan
+        self.active[index] = True
+        self.landed[index] = False
+        return index
+    
+    def remove(self, index):
+        self.active[index] = False
+    
+    def lander(self, index):
+        return Lander(self, int(index))
+    
+    def velocities(self, index=slice(None)):
+        # Скорости по долготе, широте (угловые) и высоте
+        up, east, north = local_frame(self.lon[index], self.lat[index])
+        velocity = self.velocity[index]
+        heig = self.heig[index]
+        v_heig = (velocity * up).sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v_lon = (velocity * east).sum(axis=-1) / (heig * np.cos(self.lat[index]))
+        v_lat = (velocity * north).sum(axis=-1) / heig
+        return v_lon, v_lat, v_heig
+    
+    def update(self, surface_height):
+        # Один шаг физики всех летящих лендеров; surface_height(lon, lat) принимает массивы
+        index = np.flatnonzero(self.active[:self.count] & ~self.landed[:self.count])
+        self.time += self.step
+        self.just_landed = index[:0]
+        if len(index) == 0:
+            return
+        position = self.position[index]
+        heig = np.linalg.norm(position, axis=1)
+        up = position / heig[:, None]
+        _, east, north = local_frame(self.lon[index], self.lat[index])
+        thrust = self.thrust[index]
+        acceleration = (thrust[:, :1] * up + thrust[:, 1:2] * east + thrust[:, 2:] * north) / self.mass[index, None]
+        acceleration -= up * (self.surface_gravity() * (self.radius / heig) ** 2)[:, None]
+        
+        velocity = self.velocity[index] + acceleration * self.step
+        start = position
+        position = position + velocity * self.step
+        swept = None
+        if self.collider is not None:
+            toi, point, normal = self.collider.sweep(start, position, lander_offsets(self.lon[index], self.lat[index], self.size[index]))
+            swept = np.isfinite(toi)
+            position[swept] = start[swept] + (position[swept] - start[swept]) * toi[swept, None]
+        
+        heig = np.linalg.norm(position, axis=1)
+        lat = np.arcsin(np.clip(position[:, 1] / heig, -1, 1))
+        # Долгота без скачка на ±180°: приращение к прошлому значению
+        lon = self.lon[index]
+        lon = lon + (np.arctan2(position[:, 2], position[:, 0]) - lon + math.pi) % (2 * math.pi) - math.pi
+        surface = np.asarray(surface_height(lon, lat), dtype=float)
+        
+        contact = heig <= surface
+        if swept is not None:
+            # Тетраэдр коснулся рельефа внутри шага: положение и время - в момент касания
+            contact &= ~swept
+            hit = index[swept]
+            self.touchdown_time[hit] = self.time - self.step * (1 - toi[swept])
+            self.contact_point[hit] = point[swept]
+            self.contact_normal[hit] = normal[swept]
+        if contact.any():
+            # Центр под поверхностью в конце шага: ставится на поверхность
+            hit = index[contact]
+            position[contact] *= (surface[contact] / heig[contact])[:, None]
+            heig[contact] = surface[contact]
+            self.touchdown_time[hit] = self.time
+            self.contact_point[hit] = position[contact]
+            self.contact_normal[hit] = position[contact] / heig[contact, None]
+        if swept is not None:
+            contact |= swept
+        if contact.any():
+            hit = index[contact]
+            self.touchdown_speed[hit] = np.linalg.norm(velocity[contact], axis=1)
+            velocity[contact] = 0
+            self.landed[hit] = True
+            self.just_landed = hit
+        
+        self.position[index] = position
+        self.velocity[index] = velocity
+        self.lon[index] = lon
+        self.lat[index] = lat
+        self.heig[index] = heig
+        self.surface[index] = surface
+        if self.recorder is not None:
+            self.recorder.record(self, index)
+    
+    def advance(self, frame_time, surface_height):
+        # Столько фиксированных шагов, сколько накопилось за кадр; при долгом кадре отставание сбрасывается
+        self.accumulator += frame_time
+        steps = 0
+        while self.accumulator >= self.step and steps < self.max_steps:
+            self.previous[:self.count] = self.position[:self.count]
+            self.update(surface_height)
+            self.accumulator -= self.step
+            steps += 1
+        if steps == self.max_steps:
+            self.accumulator = min(self.accumulator, self.step)
+        return steps
+    
+    def display_positions(self, index=slice(None)):
+        alpha = self.accumulator / self.step
+        previous = self.previous[:self.count][index]
+        return previous + (self.position[:self.count][index] - previous) * alpha
+    
+    def altitudes(self, index=slice(None), beam=math.radians(10), rays=0):
+        # Радиовысотомер. Отвесный луч идёт по радиусу, так что его отражение - просто высота центра
+        # над рельефом в той же точке, без трассировки. С rays > 0 добавляются rays лучей по краю конуса
+        # с полууглом beam (inf - рельеф не найден): склон сбоку радар видит раньше, но это уже raycast.
+        # Без collider - высота центра над surface прошлого шага
+        heig = self.heig[:self.count][index]
+        if self.collider is None:
+            return heig - self.surface[:self.count][index]
+        lon = self.lon[:self.count][index]
+        lat = self.lat[:self.count][index]
+        distance = heig - self.collider.surface_height(lon, lat)
+        if rays == 0:
+            return distance
+        position = np.atleast_2d(self.position[:self.count][index])
+        up, east, north = local_frame(np.atleast_1d(lon), np.atleast_1d(lat))
+        angles = np.arange(rays) * (2 * math.pi / rays)
+        ring = math.tan(beam) * (np.cos(angles)[:, None, None] * east + np.sin(angles)[:, None, None] * north)
+        slanted = self.collider.raycast(np.broadcast_to(position, ring.shape), ring - up)[0]
+        return np.minimum(distance, slanted.reshape(rays, -1).min(axis=0).reshape(np.shape(heig)))
 
 class Lander:
-    def __init__(self, lon=0, lat=0, heig=1.0, v_lon=0, v_lat=0, v_heig=0, size=0.1, heig_planet=1.0):
-        self.lon = lon
-        self.lat = lat
-        self.heig = heig
-        self.v_lon = v_lon
-        self.v_lat = v_lat
-        self.v_heig = v_heig
-        self.size = size
-        self.heig_planet = heig_planet
-        self.exists = True
-        
-    def update_velocity(self, dt):
-        self.lon += self.v_lon * dt
-        self.lat += self.v_lat * dt
-        self.heig += self.v_heig * dt
-        
-        if self.heig < self.heig_planet:
-            self.heig = 0
-            self.v_heig = 0
-    
-    def update_height(self, heig_planet):
-        self.heig_planet = heig_planet
+    # Один лендер флота; атрибуты читаются из массивов LanderFleet
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index
+    
+    lon = property(lambda self: float(self.fleet.lon[self.index]))
+    lat = property(lambda self: float(self.fleet.lat[self.index]))
+    heig = property(lambda self: float(self.fleet.heig[self.index]))
+    size = property(lambda self: float(self.fleet.size[self.index]))
+    heig_planet = property(lambda self: float(self.fleet.surface[self.index]))
+    landed = property(lambda self: bool(self.fleet.landed[self.index]))
+    v_lon = property(lambda self: float(self.fleet.velocities(self.index)[0]))
+    v_lat = property(lambda self: float(self.fleet.velocities(self.index)[1]))
+    v_heig = property(lambda self: float(self.fleet.velocities(self.index)[2]))
+    
+    @property
+    def exists(self):
+        return bool(self.fleet.active[self.index])
+    
+    @exists.setter
+    def exists(self, value):
+        self.fleet.active[self.index] = value
     
     def get_cartesian_position(self, heig):
         cos_lat = math.cos(self.lat)
@@ -316,6 +2270,12 @@ class Lander:
         z = heig * cos_lat * math.sin(self.lon)
         return (x, y, z)
     
+    def display_position(self):
+        return tuple(self.fleet.display_positions(self.index).tolist())
+    
+    def altitude(self):
+        return float(self.fleet.altitudes([self.index])[0])
+    
     def draw(self):
         if not self.exists:
             return
@@ -323,30 +2283,12 @@ class Lander:
         glDisable(GL_LIGHTING)
         glColor3f(1.0, 0.0, 0.0)
         
-        x, y, z = self.get_cartesian_position(self.heig)
-        
-        # Рисуем тетраэдр
-        s = self.size
-        
-        # Вершины тетраэдра
-        vertices = [
-            (x, y + s, z),      # Верхняя вершина
-            (x - s, y - s, z - s),  # Основание 1
-            (x + s, y - s, z - s),  # Основание 2
-            (x, y - s, z + s)       # Основание 3
-        ]
-        
-        # Грани тетраэдра
-        faces = [
-            (0, 1, 2),
-            (0, 2, 3),
-            (0, 3, 1),
-            (1, 3, 2)
-        ]
+        # Тот же тетраэдр, что проверяется на столкновения: вершина вверх, основание к поверхности
+        vertices = (np.array(self.display_position()) + lander_offsets(self.lon, self.lat, self.size)).tolist()
         
         # Отрисовка тетраэдра
         glBegin(GL_TRIANGLES)
-        for face in faces:
+        for face in TETRAHEDRON_FACES.tolist():
             for vertex_idx in face:
                 glVertex3f(*vertices[vertex_idx])
         glEnd()
@@ -354,6 +2296,11 @@ class Lander:
         glEnable(GL_LIGHTING)
 
 class SectorCamera:
+    fov = 45
+    aspect = 800/600
+    near = 0.1
+    far = 100.0
+    
     def __init__(self, planet, lander=None):
         self.planet = planet
         self.lander = lander
@@ -375,22 +2322,74 @@ class SectorCamera:
     
     def update_camera_position(self):
         glLoadIdentity()
-        gluPerspective(45, 800/600, 0.1, 100.0)
+        gluPerspective(self.fov, self.aspect, self.near, self.far)
         
         if self.follow_lander and self.lander and self.lander.exists:
             glTranslatef(0.0, 0.0, -self.distance)
             
             glRotatef(self.rotation_x, 1, 0, 0)
             glRotatef(self.rotation_y, 0, 1, 0)
-            x, y, z = self.lander.get_cartesian_position(self.lander.heig)
+            x, y, z = self.lander.display_position()
             glTranslatef(-x, -y, -z)
         else:
             glTranslatef(0.0, 0.0, -self.distance)
             
             glRotatef(self.rotation_x, 1, 0, 0)
             glRotatef(self.rotation_y, 0, 1, 0)
-            sector_center = self.planet.sectors[self.planet.radius_render-1][self.planet.radius_render-1]
-            glTranslatef(-sector_center.center_x, -sector_center.center_y, -sector_center.center_z)
+            x, y, z = self.planet.center_point()
+            glTranslatef(-x, -y, -z)
+    
+    def target_position(self):
+        if self.follow_lander and self.lander and self.lander.exists:
+            return self.lander.display_position()
+        return self.planet.center_point()
+    
+    def eye_position(self):
+        # Положение камеры в мировых координатах: обратное к преобразованию из update_camera_position
+        ax = math.radians(self.rotation_x)
+        ay = math.radians(self.rotation_y)
+        x, y, z = self.target_position()
+        return (x - self.distance * math.cos(ax) * math.sin(ay),
+                y + self.distance * math.sin(ax),
+                z + self.distance * math.cos(ax) * math.cos(ay))
+    
+    def view_projection_matrix(self):
+        # Та же матрица, что собирает update_camera_position: P * T(0,0,-d) * Rx * Ry * T(-target)
+        f = 1 / math.tan(math.radians(self.fov) / 2)
+        projection = np.array([
+            [f / self.aspect, 0, 0, 0],
+            [0, f, 0, 0],
+            [0, 0, (self.far + self.near) / (self.near - self.far), 2 * self.far * self.near / (self.near - self.far)],
+            [0, 0, -1, 0],
+        ])
+        ax = math.radians(self.rotation_x)
+        ay = math.radians(self.rotation_y)
+        rotate_x = np.array([[1, 0, 0, 0], [0, math.cos(ax), -math.sin(ax), 0], [0, math.sin(ax), math.cos(ax), 0], [0, 0, 0, 1]])
+        rotate_y = np.array([[math.cos(ay), 0, math.sin(ay), 0], [0, 1, 0, 0], [-math.sin(ay), 0, math.cos(ay), 0], [0, 0, 0, 1]])
+        back = np.eye(4)
+        back[2, 3] = -self.distance
+        to_target = np.eye(4)
+        to_target[:3, 3] = np.negative(self.target_position())
+        return projection @ back @ rotate_x @ rotate_y @ to_target
+    
+    def ray(self, x, y, width, height):
+        # Лучи из камеры через точки окна (x, y в пикселях, числа или массивы): начала на ближней
+        # плоскости и единичные направления
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        inverse = np.linalg.inv(self.view_projection_matrix())
+        ndc = np.stack([2 * x / width - 1, 1 - 2 * y / height, -np.ones_like(x), np.ones_like(x)], axis=-1)
+        near = ndc @ inverse.T
+        ndc[..., 2] = 1
+        far = ndc @ inverse.T
+        near = near[..., :3] / near[..., 3:]
+        direction = far[..., :3] / far[..., 3:] - near
+        return near, direction / np.linalg.norm(direction, axis=-1, keepdims=True)
+    
+    def frustum_planes(self):
+        # Плоскости пирамиды видимости (a, b, c, d), нормали внутрь: left, right, bottom, top, near, far
+        m = self.view_projection_matrix()
+        planes = np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+        return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
     
     def zoom(self, delta):
         if not self.follow_lander:
@@ -400,6 +2399,21 @@ class SectorCamera:
         self.rotation_y += delta_x * 0.5
         self.rotation_x = max(-90, min(90, self.rotation_x + delta_y * 0.5))
 
+def draw_markers(longitude, latitude, height, size=4.0):
+    # Лендеры записи - точками, одним вызовом рисования
+    cos_lat = np.cos(latitude)
+    points = np.stack([height * cos_lat * np.cos(longitude), height * np.sin(latitude), height * cos_lat * np.sin(longitude)], axis=1)
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    glDisable(GL_LIGHTING)
+    glColor3f(1.0, 0.3, 0.2)
+    glPointSize(size)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, points)
+    glDrawArrays(GL_POINTS, 0, len(points))
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glPointSize(1.0)
+    glEnable(GL_LIGHTING)
+
 class WireframeMaterial:
     @staticmethod
     def setup_wireframe():
@@ -453,38 +2467,18 @@ def list_saved_areas():
         print(f"{i}. {filename}")
     return bin_files
 
-def CustomSector():
-    print("\n=== Создание новой планеты ===")
-    Radius_sectors = int(input("Радиус прорисовки: "))
-    Long, Lat = map(int, input("Долгота и широта центра: ").split())
-    Radiu = int(input("Радиус Планеты (средний): "))
-    Details = int(input("Детализация: "))
-    
-    planet = Planet(Radius_sectors, Long, Lat, Radiu, Details)
-    
-    """save = input("Сохранить область? (y/n): ").lower().strip()
-    if save == 'y':
-        planet.save_to_file()"""
-    
+def build_planet(radius_render, longitude, latitude, radius, details, seed=0, store=None, quadtree=False, max_error=2.0,
+                 cache_bytes=SECTOR_CACHE_BYTES):
+    # Планета с готовыми сетками всех секторов; выполняется в фоне, пока на экране старая планета
+    if quadtree:
+        return QuadtreePlanet(radius_render, longitude, latitude, radius, details, seed, store, max_error)
+    planet = Planet(radius_render, longitude, latitude, radius, details, seed, store, cache_bytes)
+    for row in planet.sectors:
+        for sector in row:
+            sector.set_mesh(sector.load_mesh())
     return planet
 
-def load_sector_interactive():
-    bin_files = list_saved_areas()
-    if not bin_files:
-        return None
-    
-    try:
-        choice = int(input("Выберите номер планеты для загрузки: ")) - 1
-        if 0 <= choice < len(bin_files):
-            return Planet.load_from_file(bin_files[choice])
-        else:
-            print("Неверный выбор")
-            return None
-    except ValueError:
-        print("Введите число")
-        return None
-
-def update_sectors(planet, delta_lon, delta_lat): 
+def update_sectors(planet, delta_lon, delta_lat, streamer=None): 
     size_sectors = (planet.radius_render-1)*2+1
     new_sectors = [[None for _ in range(size_sectors)] for _ in range(size_sectors)]
     for i in range(len(planet.sectors)):
@@ -494,61 +2488,1458 @@ def update_sectors(planet, delta_lon, delta_lat):
             new_j = j - delta_lat
             if 0 <= new_i < size_sectors and 0 <= new_j < size_sectors:
                 new_sectors[new_i][new_j] = sector
+            else:
+                if streamer is not None:
+                    streamer.discard(sector)
+                planet.cache.put(sector)
     for i in range(size_sectors):
         for j in range(size_sectors):
             if new_sectors[i][j] is None:
                 new_lon = planet.longitude + i - (planet.radius_render - 1)
                 new_lat = planet.latitude + j - (planet.radius_render - 1)
                 
-                new_sectors[i][j] = SphereSector(planet.radius, math.radians(new_lon), math.radians(new_lat), new_lon, new_lat, planet.details)
+                sector = planet.cache.take((new_lon, new_lat, planet.details, planet.seed))
+                if sector is None:
+                    sector = SphereSector(planet.radius, math.radians(new_lon), math.radians(new_lat), new_lon, new_lat, planet.details, planet.seed, planet.store, planet.edges)
+                    sector.set_level(planet.desired_level(sector))
+                    if streamer is not None:
+                        streamer.request(sector)
+                else:
+                    sector.set_level(planet.desired_level(sector))
+                new_sectors[i][j] = sector
     planet.sectors = new_sectors
+    r = planet.radius_render
+    planet.edges.prune(planet.longitude - r, planet.longitude + r, planet.latitude - r, planet.latitude + r)
     return planet
 
+def _build_mesh(sector):
+    start = time.perf_counter()
+    mesh = sector.load_mesh()
+    return mesh, time.perf_counter() - start
+
+class SectorStreamer:
+    # Строит сетки секторов в пуле потоков; готовые сетки забирает поток отрисовки в poll()
+    def __init__(self, workers=None, keep_ready=64):
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.keep_ready = keep_ready
+        self.pending = {}
+        self.ready = {}
+        # Суммарное время фоновой сборки сеток, забранных последним poll()
+        self.build_time = 0.0
+    
+    def _submit(self, sector):
+        key = sector.tile_key()
+        if key in self.ready or key in self.pending:
+            return
+        self.pending[key] = (sector, self.executor.submit(_build_mesh, sector))
+    
+    def request(self, sector):
+        key = sector.tile_key()
+        mesh = self.ready.pop(key, None)
+        if mesh is not None:
+            sector.set_mesh(mesh)
+            return
+        sector.make_placeholder()
+        if key in self.pending:
+            _, future = self.pending[key]
+            self.pending[key] = (sector, future)
+        else:
+            self._submit(sector)
+    
+    def discard(self, sector):
+        key = sector.tile_key()
+        entry = self.pending.get(key)
+        if entry is not None and entry[0] is sector and entry[1].cancel():
+            del self.pending[key]
+    
+    def prefetch(self, planet, v_lon, v_lat):
+        # Сектора на шаг за границей окна в направлении движения лендера
+        step_lon = (v_lon > 0) - (v_lon < 0)
+        step_lat = (v_lat > 0) - (v_lat < 0)
+        if step_lon == 0 and step_lat == 0:
+            return
+        r = planet.radius_render - 1
+        cells = set()
+        for k in range(-r, r + 1):
+            if step_lon:
+                cells.add((planet.longitude + step_lon * (r + 1), planet.latitude + k))
+            if step_lat:
+                cells.add((planet.longitude + k, planet.latitude + step_lat * (r + 1)))
+        if step_lon and step_lat:
+            cells.add((planet.longitude + step_lon * (r + 1), planet.latitude + step_lat * (r + 1)))
+        for lon, lat in cells:
+            if (lon, lat, planet.details, planet.seed) in planet.cache:
+                continue
+            sector = SphereSector(planet.radius, math.radians(lon), math.radians(lat), lon, lat, planet.details, planet.seed, planet.store, planet.edges)
+            sector.set_level(planet.desired_level(sector))
+            self._submit(sector)
+        self._trim(planet)
+    
+    def _trim(self, planet):
+        if len(self.ready) <= self.keep_ready:
+            return
+        def distance(key):
+            return max(abs(key[3] - planet.longitude), abs(key[4] - planet.latitude))
+        for key in sorted(self.ready, key=distance)[self.keep_ready:]:
+            del self.ready[key]
+    
+    def poll(self, planet):
+        finished = [key for key, (_, future) in self.pending.items() if future.done()]
+        self.build_time = 0.0
+        visible = set()
+        for row in planet.sectors:
+            for sector in row:
+                visible.add(id(sector))
+        for key in finished:
+            sector, future = self.pending.pop(key)
+            if future.cancelled():
+                continue
+            mesh, elapsed = future.result()
+            self.build_time += elapsed
+            if id(sector) in visible and not sector.ready:
+                sector.set_mesh(mesh)
+            else:
+                self.ready[key] = mesh
+        return len(finished)
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+
+def simulate_landing(fleet, surface_height, max_time=600.0):
+    # Шаги физики всех лендеров флота без отрисовки, пока все не сядут; surface_height(lon, lat) принимает массивы.
+    # Скорость - модуль скорости в момент касания
+    while fleet.time < max_time and (fleet.active[:fleet.count] & ~fleet.landed[:fleet.count]).any():
+        fleet.update(surface_height)
+    n = fleet.count
+    return {
+        'landed': fleet.landed[:n].copy(),
+        'time': np.where(fleet.landed[:n], fleet.touchdown_time[:n], fleet.time),
+        'lon': np.degrees(fleet.lon[:n]),
+        'lat': np.degrees(fleet.lat[:n]),
+        'heig': fleet.heig[:n].copy(),
+        'speed': np.where(fleet.landed[:n], fleet.touchdown_speed[:n], np.linalg.norm(fleet.velocity[:n], axis=1)),
+    }
+
+TRAJ_MAGIC = b"LSTJ"
+TRAJ_VERSION = 1
+_TRAJ_HEADER = struct.Struct("<4sIdI")
+_TRAJ_CHUNK = struct.Struct("<4sIIdd")
+_TRAJ_INDEX = struct.Struct("<ddQ")
+TRAJ_COLUMNS = (("time", np.float64), ("lander", np.uint32), ("lon", np.float32), ("lat", np.float32), ("heig", np.float32),
+                ("v_lon", np.float32), ("v_lat", np.float32), ("v_heig", np.float32), ("flags", np.uint8))
+# Флаги строки: лендер сел, касание на этом шаге, строка ключевого кадра
+TRAJ_LANDED = 1
+TRAJ_CONTACT = 2
+TRAJ_KEYFRAME = 4
+
+_UINT_TYPES = {1: np.uint8, 4: np.uint32, 8: np.uint64}
+
+def _pack_chunk(columns):
+    # Строки упорядочиваются по лендеру, затем по времени, и каждое число заменяется второй разностью
+    # его битового представления как беззнакового целого: у соседних состояний одного лендера старшие
+    # разряды совпадают, и в разностях там нули. Затем байты чисел переставляются по разрядам
+    # (сначала все младшие байты и т.д.) и сжимаются zlib
+    order = np.lexsort((columns['time'], columns['lander']))
+    parts = []
+    for name, dtype in TRAJ_COLUMNS:
+        data = np.ascontiguousarray(columns[name], dtype=dtype)[order]
+        bits = data.view(_UINT_TYPES[data.itemsize])
+        # Вторая разность целочисленного представления: при плавном движении она почти нулевая
+        delta = bits.copy()
+        delta[1:] -= bits[:-1]
+        delta[1:] -= delta[:-1].copy()
+        parts.append(np.ascontiguousarray(delta.view(np.uint8).reshape(-1, data.itemsize).T).tobytes())
+    return zlib.compress(b"".join(parts), 6)
+
+def _unpack_chunk(payload, rows):
+    data = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+    columns = {}
+    offset = 0
+    for name, dtype in TRAJ_COLUMNS:
+        size = np.dtype(dtype).itemsize
+        block = np.ascontiguousarray(data[offset:offset + rows * size].reshape(size, rows).T)
+        bits = block.view(_UINT_TYPES[size]).reshape(rows)
+        columns[name] = np.cumsum(np.cumsum(bits, dtype=bits.dtype), dtype=bits.dtype).view(dtype)
+        offset += rows * size
+    # Обратно в порядок записи: по времени, внутри шага по номеру лендера
+    order = np.lexsort((columns['lander'], columns['time']))
+    return {name: values[order] for name, values in columns.items()}
+
+class TrajectoryRecorder:
+    # Запись состояния лендеров после каждого шага физики в файл только на дописывание.
+    # Строки копятся в блоки; блок сжимается и пишется в фоновом потоке, в соседний файл .idx
+    # добавляется запись (время начала, время конца, смещение). Каждый блок начинается ключевым
+    # кадром - состоянием всех лендеров, так что для перехода к любому моменту нужен один блок.
+    # Севшие лендеры больше не пишутся; every > 1 пропускает шаги, кроме шагов с касанием
+    def __init__(self, path, step, every=1, chunk_rows=16384, chunk_time=10.0):
+        self.path = path
+        self.every = every
+        self.chunk_rows = chunk_rows
+        self.chunk_time = chunk_time
+        self.steps = 0
+        self.rows = 0
+        self.bytes = _TRAJ_HEADER.size
+        self._columns = []
+        self._chunk_start = None
+        self._file = open(path, 'wb')
+        self._index = open(path + ".idx", 'wb')
+        self._file.write(_TRAJ_HEADER.pack(TRAJ_MAGIC, TRAJ_VERSION, step, every))
+        self._writer = ThreadPoolExecutor(max_workers=1)
+    
+    def attach(self, fleet):
+        # Запись начинается с ключевого кадра начального состояния
+        fleet.recorder = self
+        self.record(fleet, np.empty(0, dtype=np.int64))
+    
+    def record(self, fleet, index):
+        self.steps += 1
+        if self._chunk_start is None:
+            # Ключевой кадр: все лендеры флота
+            self._chunk_start = fleet.time
+            index = np.flatnonzero(fleet.active[:fleet.count])
+            keyframe = True
+        else:
+            if self.steps % self.every:
+                index = index[fleet.landed[index]]
+            keyframe = False
+        if len(index) == 0:
+            return
+        v_lon, v_lat, v_heig = fleet.velocities(index)
+        landed = fleet.landed[index]
+        flags = np.where(landed, TRAJ_LANDED, 0) | np.where(np.isin(index, fleet.just_landed), TRAJ_CONTACT, 0)
+        if keyframe:
+            flags |= TRAJ_KEYFRAME
+        self._columns.append({
+            'time': np.full(len(index), fleet.time), 'lander': index, 'lon': fleet.lon[index], 'lat': fleet.lat[index],
+            'heig': fleet.heig[index], 'v_lon': v_lon, 'v_lat': v_lat, 'v_heig': v_heig, 'flags': flags,
+        })
+        self.rows += len(index)
+        if sum(len(part['time']) for part in self._columns) >= self.chunk_rows or fleet.time - self._chunk_start >= self.chunk_time:
+            self.flush()
+    
+    def flush(self):
+        if not self._columns:
+            self._chunk_start = None
+            return
+        columns = {name: np.concatenate([part[name] for part in self._columns]) for name, _ in TRAJ_COLUMNS}
+        self._columns = []
+        self._chunk_start = None
+        self._writer.submit(self._write_chunk, columns)
+    
+    def _write_chunk(self, columns):
+        payload = _pack_chunk(columns)
+        t_first = float(columns['time'][0])
+        t_last = float(columns['time'][-1])
+        offset = self._file.tell()
+        self._file.write(_TRAJ_CHUNK.pack(b"CHNK", len(columns['time']), len(payload), t_first, t_last))
+        self._file.write(payload)
+        self._file.flush()
+        # Запись индекса - после данных блока, чтобы индекс не ссылался на недописанный блок
+        self._index.write(_TRAJ_INDEX.pack(t_first, t_last, offset))
+        self._index.flush()
+        self.bytes += _TRAJ_CHUNK.size + len(payload)
+    
+    def close(self):
+        self.flush()
+        self._writer.shutdown(wait=True)
+        self._file.close()
+        self._index.close()
+
+class TrajectoryReader:
+    # Чтение записи без загрузки файла целиком: в памяти индекс блоков и пара последних распакованных блоков
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, version, self.step, self.every = _TRAJ_HEADER.unpack(self._file.read(_TRAJ_HEADER.size))
+        if magic != TRAJ_MAGIC:
+            raise ValueError("не файл траектории")
+        if version != TRAJ_VERSION:
+            raise ValueError(f"версия траектории {version}, ожидается {TRAJ_VERSION}")
+        if os.path.exists(path + ".idx"):
+            entries = np.fromfile(path + ".idx", dtype=np.dtype([('t_first', '<f8'), ('t_last', '<f8'), ('offset', '<u8')]))
+        else:
+            entries = self._scan()
+        self.t_first = entries['t_first']
+        self.t_last = entries['t_last']
+        self.offsets = entries['offset']
+        self._cache = {}
+    
+    def _scan(self):
+        # Индекс потерян - восстанавливается по заголовкам блоков
+        entries = []
+        offset = _TRAJ_HEADER.size
+        size = os.path.getsize(self.path)
+        while offset + _TRAJ_CHUNK.size <= size:
+            self._file.seek(offset)
+            magic, rows, length, t_first, t_last = _TRAJ_CHUNK.unpack(self._file.read(_TRAJ_CHUNK.size))
+            if magic != b"CHNK" or offset + _TRAJ_CHUNK.size + length > size:
+                break
+            entries.append((t_first, t_last, offset))
+            offset += _TRAJ_CHUNK.size + length
+        return np.array(entries, dtype=[('t_first', '<f8'), ('t_last', '<f8'), ('offset', '<u8')])
+    
+    @property
+    def start(self):
+        return float(self.t_first[0]) if len(self.t_first) else 0.0
+    
+    @property
+    def end(self):
+        return float(self.t_last[-1]) if len(self.t_last) else 0.0
+    
+    def chunk(self, k):
+        columns = self._cache.get(k)
+        if columns is None:
+            self._file.seek(int(self.offsets[k]))
+            _, rows, length, _, _ = _TRAJ_CHUNK.unpack(self._file.read(_TRAJ_CHUNK.size))
+            columns = _unpack_chunk(self._file.read(length), rows)
+            if len(self._cache) >= 2:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[k] = columns
+        return columns
+    
+    def state_at(self, t):
+        # Последняя запись каждого лендера не позже t; None - запись ещё не началась
+        if len(self.t_first) == 0 or t < self.t_first[0]:
+            return None
+        columns = self.chunk(int(np.searchsorted(self.t_first, t, side='right')) - 1)
+        rows = int(np.searchsorted(columns['time'], t, side='right'))
+        landers = columns['lander'][:rows][::-1]
+        _, last = np.unique(landers, return_index=True)
+        last = rows - 1 - last
+        return {name: values[last] for name, values in columns.items()}
+    
+    def close(self):
+        self._file.close()
+
+SWEEP_PARAMETERS = ("lon", "lat", "heig", "v_lon", "v_lat", "v_heig")
+SWEEP_COLUMNS = (("run", np.int64),) + tuple((name + "0", np.float64) for name in SWEEP_PARAMETERS) + (
+    ("landed", np.uint8), ("time", np.float64), ("lon", np.float64), ("lat", np.float64), ("speed", np.float64))
 
+def parse_distribution(spec):
+    # "X" - константа, "U:a:b" - равномерное на [a, b), "N:mu:sigma" - нормальное
+    parts = spec.split(":")
+    try:
+        if len(parts) == 1:
+            return ("C", float(parts[0]), 0.0)
+        if len(parts) == 3 and parts[0].upper() in ("U", "N"):
+            return (parts[0].upper(), float(parts[1]), float(parts[2]))
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"неверное распределение: {spec}")
 
-def main():
+def sample_distribution(rng, distribution, n):
+    kind, a, b = distribution
+    if kind == "U":
+        return rng.uniform(a, b, n)
+    if kind == "N":
+        return rng.normal(a, b, n)
+    return np.full(n, a)
+
+class ColumnWriter:
+    # Поколоночная запись: по файлу <колонка>.bin на каждую колонку и manifest.json с типами и числом строк
+    def __init__(self, directory, columns):
+        self.directory = directory
+        self.columns = columns
+        self.rows = 0
+        os.makedirs(directory, exist_ok=True)
+        self.files = {name: open(os.path.join(directory, name + ".bin"), 'wb') for name, _ in columns}
+        self._write_manifest()
+    
+    def _write_manifest(self):
+        manifest = {'rows': self.rows, 'columns': [[name, np.dtype(dtype).str] for name, dtype in self.columns]}
+        with open(os.path.join(self.directory, "manifest.json"), 'w') as f:
+            json.dump(manifest, f)
+    
+    def append(self, arrays):
+        for name, dtype in self.columns:
+            self.files[name].write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+            self.files[name].flush()
+        self.rows += len(arrays[self.columns[0][0]])
+        self._write_manifest()
+    
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def load_columns(directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    return {name: np.memmap(os.path.join(directory, name + ".bin"), dtype=dtype, mode='r', shape=(manifest['rows'],))
+            for name, dtype in manifest['columns'] if manifest['rows'] > 0}
+
+_sweep_terrain = None
+
+def _init_sweep_worker(directory, max_bytes, radius, details, seed):
+    # Все процессы пула читают один дисковый кэш тайлов
+    global _sweep_terrain
+    _sweep_terrain = TileTerrain(TileStore(directory, max_bytes), radius, details, seed)
+
+def _run_sweep_chunk(job):
+    start, params, size, dt, max_time, radius, gravity, mass, thrust = job
+    n = len(params)
+    result = {name: np.zeros(n, dtype) for name, dtype in SWEEP_COLUMNS}
+    result['run'] = np.arange(start, start + n)
+    for k, name in enumerate(SWEEP_PARAMETERS):
+        result[name + "0"] = params[:, k]
+    # Весь блок считается одним флотом: шаг физики векторный по всем лендерам
+    fleet = LanderFleet(radius, dt, gravity, n)
+    lon, lat, heig, v_lon, v_lat, v_heig = params.T
+    fleet.spawn(np.radians(lon), np.radians(lat), heig, v_lon, v_lat, v_heig, size, mass, thrust)
+    landing = simulate_landing(fleet, _sweep_terrain.height, max_time)
+    for name in ("landed", "time", "lon", "lat", "speed"):
+        result[name][:] = landing[name]
+    return result
+
+def run_sweep(args):
+    rng = np.random.default_rng(args.sweep_seed)
+    params = np.column_stack([sample_distribution(rng, getattr(args, name), args.sweep) for name in SWEEP_PARAMETERS])
+    workers = args.workers or os.cpu_count() or 1
+    chunk = max(1, min(256, args.sweep // (workers * 8)))
+    jobs = [(start, params[start:start + chunk], args.size, args.dt, args.max_time, args.radius, args.gravity, args.mass, args.thrust)
+            for start in range(0, args.sweep, chunk)]
+    
+    writer = ColumnWriter(args.out, SWEEP_COLUMNS)
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_sweep_worker,
+                             initargs=(args.tiles, int(args.tile_cache_mb * 2**20), args.radius, args.details, args.seed)) as pool:
+        for result in pool.map(_run_sweep_chunk, jobs):
+            writer.append(result)
+    writer.close()
+    elapsed = time.perf_counter() - t0
+    # Итоги считаются по записанным колонкам, заодно проверяя, что результат читается
+    columns = load_columns(args.out)
+    landed = columns['landed'].astype(bool) if columns else np.zeros(0, dtype=bool)
+    print(f"Посадок: {writer.rows}, успешных: {int(landed.sum())}, время: {elapsed:.2f} с, {writer.rows / elapsed:.1f} посадок/с -> {args.out}")
+    if landed.any():
+        speed = columns['speed'][landed]
+        print(f"Скорость касания: средняя {speed.mean():.4f}, медиана {np.median(speed):.4f}, максимум {speed.max():.4f}")
+    return writer.rows
+
+_bake_store = None
+
+def _init_bake_worker(directory):
+    # Во время запекания ничего не вытесняется: лимит кэша проверяется в конце run_bake
+    global _bake_store
+    _bake_store = TileStore(directory, math.inf)
+
+def _bake_chunk(job):
+    radius, seed, details, cells = job
+    # Соседние сектора задания делят блоки высот у общих рёбер, как в Planet
+    edges = SharedEdges(radius, seed)
+    for lon, lat in cells:
+        sector = SphereSector(radius, math.radians(lon), math.radians(lat), lon, lat, details, seed, _bake_store, edges)
+        _bake_store.put(sector.tile_key(details), sector.compute_mesh(details))
+    return len(cells)
+
+def run_bake(args):
+    # Сетки всех секторов прямоугольника --bake на уровнях --bake-details в кэш тайлов --tiles.
+    # Готовые тайлы пропускаются, а put заменяет файл целиком, поэтому прерванное запекание
+    # продолжается повторным запуском той же команды
+    lon0, lat0, lon1, lat1 = args.bake
+    levels = args.bake_details or [args.details]
+    store = TileStore(args.tiles, math.inf)
+    cells = [(lon, lat) for lat in range(min(lat0, lat1), max(lat0, lat1) + 1) for lon in range(min(lon0, lon1), max(lon0, lon1) + 1)]
+    workers = args.workers or os.cpu_count() or 1
+    jobs = []
+    total = len(cells) * len(levels)
+    for details in levels:
+        todo = [(lon, lat) for lon, lat in cells if (args.seed, args.radius, details, lon, lat) not in store]
+        chunk = max(1, min(64, len(todo) // (workers * 4)))
+        jobs.extend((args.radius, args.seed, details, todo[start:start + chunk]) for start in range(0, len(todo), chunk))
+    remaining = sum(len(job[3]) for job in jobs)
+    print(f"Секторов: {total}, уже готово: {total - remaining}, осталось: {remaining}")
+    
+    baked = 0
+    t0 = time.perf_counter()
+    shown = t0
+    with ProcessPoolExecutor(workers, initializer=_init_bake_worker, initargs=(args.tiles,)) as pool:
+        futures = [pool.submit(_bake_chunk, job) for job in jobs]
+        try:
+            for future in as_completed(futures):
+                baked += future.result()
+                now = time.perf_counter()
+                if now - shown >= 1 or baked == remaining:
+                    print(f"\r{total - remaining + baked}/{total}, {baked / (now - t0):.1f} секторов/с", end="", flush=True)
+                    shown = now
+        except KeyboardInterrupt:
+            pool.shutdown(cancel_futures=True)
+            print(f"\nПрервано, запечено {baked}; повторный запуск продолжит с этого места")
+            return baked
+    elapsed = time.perf_counter() - t0
+    if remaining:
+        print()
+    print(f"Запечено секторов: {baked}, время: {elapsed:.2f} с, {baked / max(elapsed, 1e-9):.1f} секторов/с -> {args.tiles}")
+    size = store.total_bytes()
+    if size > args.tile_cache_mb * 2**20:
+        print(f"Кэш тайлов занимает {size / 2**20:.0f} МБ, больше --tile-cache-mb {args.tile_cache_mb:g}: "
+              f"запускайте сессии с большим --tile-cache-mb, иначе старые тайлы будут вытеснены")
+    return baked
+
+def run_sites(args):
+    # Самые пологие площадки прямоугольника --sites в JSON
+    lon0, lat0, lon1, lat1 = args.sites
+    site_map = SuitabilityMap(args.radius, args.sites_details, args.seed)
+    t0 = time.perf_counter()
+    sites = site_map.best_sites(min(lon0, lon1), min(lat0, lat1), max(lon0, lon1), max(lat0, lat1), args.sites_k,
+                                args.sites_separation, args.sites_max_roughness)
+    elapsed = time.perf_counter() - t0
+    result = [{name: values[k].item() for name, values in sites.items()} for k in range(len(sites['lon']))]
+    print(json.dumps({'sectors': site_map.misses, 'seconds': elapsed, 'sites': result}))
+    return result
+
+def run_headless(args):
+    # Рельеф - по сеткам из кэша тайлов, как у серии посадок: запечённые области не пересчитываются
+    terrain = TileTerrain(TileStore(args.tiles, int(args.tile_cache_mb * 2**20)), args.radius, args.details, args.seed)
+    lon, lat, heig, v_lon, v_lat, v_heig = args.lander
+    fleet = LanderFleet(args.radius, args.dt, args.gravity)
+    fleet.spawn(math.radians(lon), math.radians(lat), heig, v_lon, v_lat, v_heig, args.size, args.mass, args.thrust)
+    recorder = None
+    if args.record:
+        recorder = TrajectoryRecorder(args.record, args.dt, args.record_every)
+        recorder.attach(fleet)
+    result = {name: values[0].item() for name, values in simulate_landing(fleet, terrain.height, args.max_time).items()}
+    if recorder is not None:
+        recorder.close()
+        print(f"Записано строк: {recorder.rows}, {recorder.bytes} байт -> {args.record}")
+    print(json.dumps(result))
+    return result
+
+def run_replay(args):
+    # Состояние записанных лендеров на момент --seek (по умолчанию конец записи) в JSON;
+    # долгота и широта в градусах, как у --headless
+    reader = TrajectoryReader(args.replay)
+    t = reader.end if args.seek is None else args.seek
+    state = reader.state_at(t)
+    reader.close()
+    landers = []
+    if state is not None:
+        for k in range(len(state['lander'])):
+            lander = {name: values[k].item() for name, values in state.items()}
+            lander['lon'] = math.degrees(lander['lon'])
+            lander['lat'] = math.degrees(lander['lat'])
+            landers.append(lander)
+    print(json.dumps({'time': t, 'start': reader.start, 'end': reader.end, 'landers': landers}))
+    return landers
+
+# Протокол --serve. Запрос: заголовок (длина данных, команда, номер флота, n) и данные - массивы float64
+# little-endian по строкам; ответ: (длина данных, статус, n) и данные, при ошибке - текст UTF-8.
+#   info    -> JSON с параметрами мира и столбцами
+#   spawn   n строк SERVER_SPAWN_COLUMNS (углы в радианах) -> n номеров лендеров uint32
+#   step    n тиков, данные - пусто или тяга (вверх, восток, север) всех count лендеров -> время флота
+#   state   номера uint32 или пусто (все) -> строки SERVER_STATE_COLUMNS
+#   heights n пар (долгота, широта) -> n высот поверхности
+#   reset   флот удаляется
+SERVER_COMMANDS = ("info", "spawn", "step", "state", "heights", "reset")
+SERVER_SPAWN_COLUMNS = ("lon", "lat", "heig", "v_lon", "v_lat", "v_heig", "size", "mass")
+SERVER_STATE_COLUMNS = ("x", "y", "z", "vx", "vy", "vz", "lon", "lat", "heig", "surface", "active", "landed",
+                        "touchdown_time", "touchdown_speed")
+SERVER_MAX_PAYLOAD = 256 * 2**20
+_SERVER_REQUEST = struct.Struct("<IBHI")
+_SERVER_RESPONSE = struct.Struct("<IBI")
+
+def parse_address(address):
+    # "unix:ПУТЬ" - Unix-сокет, "ХОСТ:ПОРТ" или "ПОРТ" - TCP
+    if address.startswith("unix:"):
+        return ("unix", address[5:])
+    host, _, port = address.rpartition(":")
+    return ("tcp", host or "127.0.0.1", int(port))
+
+def _rows(payload, columns):
+    if len(payload) % (8 * columns):
+        raise ValueError(f"длина данных не кратна строке из {columns} чисел float64")
+    rows = np.frombuffer(payload, dtype='<f8').reshape(-1, columns)
+    if not np.isfinite(rows).all():
+        raise ValueError("в данных есть nan или inf")
+    return rows
+
+def _surface_points(rows):
+    # Копия строк с долготой (столбец 0), приведённой к [-pi, pi), и проверенной широтой (столбец 1)
+    if (np.abs(rows[:, 1]) > math.pi / 2).any():
+        raise ValueError("широта вне [-pi/2, pi/2]")
+    rows = rows.copy()
+    rows[:, 0] = (rows[:, 0] + math.pi) % (2 * math.pi) - math.pi
+    return rows
+
+class SimulationServer:
+    # Мир для внешних контроллеров: общий рельеф и флоты лендеров по номерам, живущие между подключениями.
+    # Команды одного флота выполняются по очереди; длинный step отдаёт цикл событий другим клиентам
+    # каждые yield_steps тиков
+    def __init__(self, terrain, radius, step=1/60, gravity=None, yield_steps=64):
+        self.terrain = terrain
+        self.radius = radius
+        self.step = step
+        self.gravity = gravity
+        self.yield_steps = yield_steps
+        self.fleets = {}
+        self._locks = {}
+        self.requests = 0
+    
+    def _fleet(self, number, create=False):
+        fleet = self.fleets.get(number)
+        if fleet is None:
+            if not create:
+                raise ValueError(f"нет флота {number}")
+            fleet = self.fleets[number] = LanderFleet(self.radius, self.step, self.gravity)
+        return fleet
+    
+    async def execute(self, command, number, n, payload):
+        # (n, данные ответа); ValueError - ошибка запроса
+        name = SERVER_COMMANDS[command] if command < len(SERVER_COMMANDS) else None
+        if name == "info":
+            info = {'radius': self.radius, 'details': self.terrain.details, 'seed': self.terrain.seed, 'step': self.step,
+                    'commands': SERVER_COMMANDS, 'spawn_columns': SERVER_SPAWN_COLUMNS, 'state_columns': SERVER_STATE_COLUMNS,
+                    'fleets': sorted(self.fleets)}
+            return 0, json.dumps(info).encode()
+        if name == "heights":
+            points = _surface_points(_rows(payload, 2))
+            return len(points), np.asarray(self.terrain.height(points[:, 0], points[:, 1]), dtype='<f8').tobytes()
+        if name is None:
+            raise ValueError(f"неизвестная команда {command}")
+        lock = self._locks.setdefault(number, asyncio.Lock())
+        async with lock:
+            if name == "spawn":
+                rows = _surface_points(_rows(payload, len(SERVER_SPAWN_COLUMNS)))
+                index = self._fleet(number, create=True).spawn(*rows.T)
+                return len(index), index.astype('<u4').tobytes()
+            if name == "reset":
+                self.fleets.pop(number, None)
+                return 0, b""
+            fleet = self._fleet(number)
+            if name == "state":
+                if len(payload) % 4:
+                    raise ValueError("длина данных не кратна номеру uint32")
+                index = np.frombuffer(payload, dtype='<u4').astype(np.int64) if payload else np.arange(fleet.count)
+                if len(index) and index.max() >= fleet.count:
+                    raise ValueError(f"во флоте {number} только {fleet.count} лендеров")
+                columns = (fleet.position[index], fleet.velocity[index], fleet.lon[index], fleet.lat[index], fleet.heig[index],
+                           fleet.surface[index], fleet.active[index], fleet.landed[index], fleet.touchdown_time[index],
+                           fleet.touchdown_speed[index])
+                return len(index), np.column_stack(columns).astype('<f8').tobytes()
+            # step
+            if payload:
+                thrust = _rows(payload, 3)
+                if len(thrust) != fleet.count:
+                    raise ValueError(f"тяга для {len(thrust)} лендеров, во флоте {fleet.count}")
+                fleet.thrust[:fleet.count] = thrust
+            for tick in range(n):
+                fleet.update(self.terrain.height)
+                if (tick + 1) % self.yield_steps == 0:
+                    await asyncio.sleep(0)
+            return n, struct.pack("<d", fleet.time)
+    
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(_SERVER_REQUEST.size)
+                except asyncio.IncompleteReadError:
+                    break
+                size, command, number, n = _SERVER_REQUEST.unpack(header)
+                if size > SERVER_MAX_PAYLOAD:
+                    writer.write(self._error(f"запрос больше {SERVER_MAX_PAYLOAD} байт"))
+                    break
+                payload = await reader.readexactly(size)
+                self.requests += 1
+                try:
+                    n, data = await self.execute(command, number, n, payload)
+                except (ValueError, IndexError) as e:
+                    writer.write(self._error(str(e)))
+                else:
+                    writer.write(_SERVER_RESPONSE.pack(len(data), 0, n) + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    @staticmethod
+    def _error(message):
+        data = message.encode()
+        return _SERVER_RESPONSE.pack(len(data), 1, 0) + data
+    
+    async def serve(self, address, ready=None):
+        kind, *where = parse_address(address)
+        if kind == "unix":
+            # Удаляется только сокет, оставшийся от прошлого запуска; любой другой файл - ошибка
+            try:
+                mode = os.lstat(where[0]).st_mode
+            except FileNotFoundError:
+                mode = None
+            if mode is not None:
+                if not stat.S_ISSOCK(mode):
+                    raise FileExistsError(f"{where[0]} уже существует и не является сокетом")
+                os.remove(where[0])
+            server = await asyncio.start_unix_server(self.handle_client, where[0])
+        else:
+            server = await asyncio.start_server(self.handle_client, *where)
+        print(f"Сервер симуляции: {address}")
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+class SimulationClient:
+    # Блокирующий клиент --serve для контроллеров и циклов обучения: каждый метод - один запрос
+    def __init__(self, address, fleet=0):
+        kind, *where = parse_address(address)
+        if kind == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(where[0])
+        else:
+            self.sock = socket.create_connection(tuple(where))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.fleet = fleet
+    
+    def _read(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("сервер закрыл соединение")
+            data += chunk
+        return bytes(data)
+    
+    def request(self, name, n=0, payload=b"", fleet=None):
+        fleet = self.fleet if fleet is None else fleet
+        self.sock.sendall(_SERVER_REQUEST.pack(len(payload), SERVER_COMMANDS.index(name), fleet, n) + payload)
+        size, status, n = _SERVER_RESPONSE.unpack(self._read(_SERVER_RESPONSE.size))
+        data = self._read(size)
+        if status:
+            raise RuntimeError(data.decode())
+        return n, data
+    
+    def info(self):
+        return json.loads(self.request("info")[1])
+    
+    def spawn(self, lon, lat, heig, v_lon=0, v_lat=0, v_heig=0, size=0.1, mass=1.0, fleet=None):
+        # Углы в радианах, аргументы - числа или массивы; возвращает номера лендеров
+        rows = np.column_stack(np.broadcast_arrays(*(np.atleast_1d(np.asarray(value, dtype='<f8'))
+                                                     for value in (lon, lat, heig, v_lon, v_lat, v_heig, size, mass))))
+        return np.frombuffer(self.request("spawn", payload=rows.tobytes(), fleet=fleet)[1], dtype='<u4')
+    
+    def step(self, ticks=1, thrust=None, fleet=None):
+        payload = b"" if thrust is None else np.ascontiguousarray(thrust, dtype='<f8').tobytes()
+        return struct.unpack("<d", self.request("step", ticks, payload, fleet)[1])[0]
+    
+    def state(self, index=None, fleet=None):
+        payload = b"" if index is None else np.asarray(index, dtype='<u4').tobytes()
+        rows = np.frombuffer(self.request("state", payload=payload, fleet=fleet)[1], dtype='<f8').reshape(-1, len(SERVER_STATE_COLUMNS))
+        return dict(zip(SERVER_STATE_COLUMNS, rows.T))
+    
+    def heights(self, longitude, latitude):
+        points = np.column_stack(np.broadcast_arrays(np.atleast_1d(np.asarray(longitude, dtype='<f8')),
+                                                     np.atleast_1d(np.asarray(latitude, dtype='<f8'))))
+        return np.frombuffer(self.request("heights", payload=points.tobytes())[1], dtype='<f8')
+    
+    def reset(self, fleet=None):
+        self.request("reset", fleet=fleet)
+    
+    def close(self):
+        self.sock.close()
+
+def run_server(args):
+    # Рельеф - по сеткам из кэша тайлов, как у --headless и --sweep; запечённые области готовы сразу
+    terrain = TileTerrain(TileStore(args.tiles, int(args.tile_cache_mb * 2**20)), args.radius, args.details, args.seed)
+    server = SimulationServer(terrain, args.radius, args.dt, args.gravity)
+    try:
+        asyncio.run(server.serve(args.serve))
+    except KeyboardInterrupt:
+        print(f"Сервер остановлен, запросов: {server.requests}")
+    except OSError as e:
+        print(f"Не удалось запустить сервер: {e}")
+        return False
+    return True
+
+def bench_case(fn, repeat=5, min_time=1.5, max_repeat=50):
+    # Время одного вызова: минимум по замерам, число вызовов в замере подбирается на ~0.2 с.
+    # Замеров не меньше repeat и столько, чтобы всего набралось min_time секунд: у коротких
+    # случаев минимум по пяти замерам ещё заметно гуляет от прогона к прогону.
+    # Сборщик мусора отключён на время замера, чтобы разброс был меньше
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = []
+        total = 0
+        while len(times) < repeat or (total < min_time and len(times) < max_repeat):
+            t = timer.timeit(number)
+            total += t
+            times.append(t / number)
+    finally:
+        if enabled:
+            gc.enable()
+    times.sort()
+    return {'seconds': times[0], 'median': times[len(times) // 2], 'calls': number, 'repeats': len(times)}
+
+# Построители замеров получают wanted(*names) - нужен ли хоть один из замеров - и готовят
+# только нужные: с --bench-filter не строятся планеты и тайлы для отфильтрованных случаев
+
+def _bench_sectors(radius, seed, wanted):
+    cases = {}
+    for details in (8, 16, 32, 64):
+        if not wanted(f"sector.vertices_normals.d{details}", f"sector.indices.d{details}"):
+            continue
+        sector = SphereSector(radius, math.radians(3), math.radians(2), 3, 2, details, seed)
+        def build(sector=sector):
+            sector._meshes.clear()
+            sector.get_vertices_and_normals()
+        cases[f"sector.vertices_normals.d{details}"] = build
+        def indices(sector=sector, details=details):
+            _grid_indices.pop(details, None)
+            _grid_edges.pop(details, None)
+            sector.generate_indices(details)
+            grid_edges(details)
+        cases[f"sector.indices.d{details}"] = indices
+    return cases
+
+def _bench_update_sectors(radius, details, seed, wanted):
+    # Сдвиг окна туда и обратно; новые секторы строятся сразу, как это делал бы поток подгрузки.
+    # step и diagonal - без кэша секторов, каждый раз с построением, как в прежних замерах;
+    # *_cached - с кэшем, вернувшиеся сектора берутся из него
+    cases = {}
+    for name, (dlon, dlat), cache_bytes in (("step", (1, 0), 0), ("diagonal", (1, 1), 0),
+                                            ("step_cached", (1, 0), SECTOR_CACHE_BYTES),
+                                            ("diagonal_cached", (1, 1), SECTOR_CACHE_BYTES)):
+        if not wanted(f"update_sectors.{name}"):
+            continue
+        planet = Planet(3, 0, 0, radius, details, seed, cache_bytes=cache_bytes)
+        direction = [1]
+        def move(planet=planet, dlon=dlon, dlat=dlat, direction=direction):
+            sign = direction[0]
+            direction[0] = -sign
+            planet.longitude += sign * dlon
+            planet.latitude += sign * dlat
+            update_sectors(planet, sign * dlon, sign * dlat)
+            for row in planet.sectors:
+                for sector in row:
+                    if not sector.has_mesh():
+                        sector.get_mesh()
+        cases[f"update_sectors.{name}"] = move
+    return cases
+
+def _bench_planet(radius, details, seed):
+    planet = Planet(3, 0, 0, radius, details, seed)
+    for row in planet.sectors:
+        for sector in row:
+            sector.get_mesh()
+    return planet
+
+def _bench_terrain(radius, seed, get_planet, wanted):
+    # get_planet() - общий для замеров рельефа и лендеров Planet с готовыми сетками
+    rng = np.random.default_rng(0)
+    longitude = np.radians(rng.uniform(-2, 2, 10000))
+    latitude = np.radians(rng.uniform(-2, 2, 10000))
+    terrain = get_terrain(seed)
+    cases = {
+        "terrain.noise.scalar": lambda: terrain.height(radius, 0.01, 0.02),
+        "terrain.noise.batch10k": lambda: terrain.height(radius, longitude, latitude),
+    }
+    if wanted("planet.surface_height.scalar", "planet.query.batch10k"):
+        planet = get_planet()
+        cases["planet.surface_height.scalar"] = lambda: planet.surface_height(0.01, 0.02)
+        cases["planet.query.batch10k"] = lambda: planet.query(longitude, latitude)
+    return cases
+
+def _bench_landers(get_planet, wanted):
+    # Лендеры висят без тяжести и не садятся, чтобы каждый шаг считал всех.
+    # У каждой группы свой генератор, чтобы фильтр не менял расстановку лендеров
+    cases = {}
+    for n in (1, 100, 1000):
+        if not wanted(f"lander.step.n{n}"):
+            continue
+        planet = get_planet()
+        rng = np.random.default_rng(n)
+        fleet = LanderFleet(planet.radius, gravity=0, capacity=n)
+        fleet.spawn(np.radians(rng.uniform(-2, 2, n)), np.radians(rng.uniform(-2, 2, n)), planet.radius + 1)
+        cases[f"lander.step.n{n}"] = lambda fleet=fleet: fleet.update(planet.surface_height)
+    # Те же лендеры у самой поверхности с проверкой касания тетраэдром
+    if wanted("lander.step_swept.n100"):
+        planet = get_planet()
+        rng = np.random.default_rng(1)
+        swept = LanderFleet(planet.radius, gravity=0, capacity=100)
+        swept.collider = planet
+        lon = np.radians(rng.uniform(-2, 2, 100))
+        lat = np.radians(rng.uniform(-2, 2, 100))
+        swept.spawn(lon, lat, planet.surface_height(lon, lat) + 0.08, size=0.05)
+        cases["lander.step_swept.n100"] = lambda: swept.update(planet.surface_height)
+    # Высотомер всех лендеров за кадр и косые лучи, как при выборе точки мышью
+    if not wanted("raycast.altimeter.n1000", "raycast.altimeter_cone.n1000", "raycast.slanted.n1000"):
+        return cases
+    planet = get_planet()
+    rng = np.random.default_rng(2)
+    fleet = LanderFleet(planet.radius, gravity=0, capacity=1000)
+    fleet.collider = planet
+    lon = np.radians(rng.uniform(-2, 2, 1000))
+    lat = np.radians(rng.uniform(-2, 2, 1000))
+    fleet.spawn(lon, lat, planet.surface_height(lon, lat) + rng.uniform(0.01, 1, 1000))
+    cases["raycast.altimeter.n1000"] = lambda: fleet.altitudes()
+    cases["raycast.altimeter_cone.n1000"] = lambda: fleet.altitudes(rays=6)
+    up, east, north = local_frame(lon, lat)
+    directions = -up + rng.uniform(-1, 1, (1000, 1)) * east + rng.uniform(-1, 1, (1000, 1)) * north
+    origins = up * (planet.radius + 0.5) - directions
+    cases["raycast.slanted.n1000"] = lambda: planet.raycast(origins, directions)
+    return cases
+
+def _bench_sites(radius, seed, wanted):
+    # Карты 1000 секторов с нуля и поиск площадок по уже посчитанным
+    cases = {}
+    cases["sites.region_cold.n1000"] = lambda: SuitabilityMap(radius, 16, seed).region(-20.5, -12.5, 19.49, 12.49)
+    if not wanted("sites.best_warm.n1000"):
+        return cases
+    site_map = SuitabilityMap(radius, 16, seed)
+    site_map.region(-20.5, -12.5, 19.49, 12.49)
+    cases["sites.best_warm.n1000"] = lambda: site_map.best_sites(-20.5, -12.5, 19.49, 12.49, k=10)
+    return cases
+
+def _bench_serialization(radius, seed, directory, wanted):
+    cases = {}
+    sizes = {}
+    if not wanted("tile.write.d64", "tile.map.d64", "tile.store_put.d64", "tile.store_get.d64"):
+        return cases, sizes
+    sector = SphereSector(radius, math.radians(3), math.radians(2), 3, 2, 64, seed)
+    key = sector.tile_key(64)
+    mesh = sector.load_mesh(64)
+    filename = os.path.join(directory, "bench.tile")
+    with open(filename, 'wb') as f:
+        write_tile(f, key, mesh)
+    sizes["tile.write.d64"] = os.path.getsize(filename)
+    def write():
+        buffer = io.BytesIO()
+        write_tile(buffer, key, mesh)
+    cases["tile.write.d64"] = write
+    cases["tile.map.d64"] = lambda: map_tile(filename)
+    store = TileStore(os.path.join(directory, "store"))
+    cases["tile.store_put.d64"] = lambda: store.put(key, mesh)
+    cases["tile.store_get.d64"] = lambda: store.get(key)
+    return cases, sizes
+
+def compare_benchmarks(results, baseline, tolerance, noise=5e-6):
+    # Сравнение с сохранённым прогоном: регрессия - замедление больше чем в 1 + tolerance раз,
+    # и при этом больше шума: noise секунд или разброса (медиана - минимум) любого из двух прогонов
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:36s} {result['seconds'] * 1e6:12.2f} мкс   (нет в базе)")
+            continue
+        ratio = result['seconds'] / base['seconds']
+        spread = max(noise, result['median'] - result['seconds'], base.get('median', base['seconds']) - base['seconds'])
+        mark = ""
+        if ratio > 1 + tolerance and result['seconds'] - base['seconds'] > spread:
+            regressions.append(name)
+            mark = "  РЕГРЕССИЯ"
+        print(f"{name:36s} {result['seconds'] * 1e6:12.2f} мкс  x{ratio:5.2f}{mark}")
+    return regressions
+
+def run_benchmarks(args):
+    # Замеры горячих путей без окна; результат - JSON, с --bench-baseline сравнение с прошлым прогоном.
+    # Замерять имеет смысл только правильный рельеф, поэтому сначала сверка с perlin_noise
+    terrain_error = check_terrain(seed=args.seed, radius=args.radius)
+    def wanted(*names):
+        return not args.bench_filter or any(args.bench_filter in name for name in names)
+    planet = []
+    def get_planet():
+        if not planet:
+            planet.append(_bench_planet(args.radius, args.details, args.seed))
+        return planet[0]
+    cases = {}
+    sizes = {}
+    cases.update(_bench_sectors(args.radius, args.seed, wanted))
+    cases.update(_bench_update_sectors(args.radius, args.details, args.seed, wanted))
+    cases.update(_bench_terrain(args.radius, args.seed, get_planet, wanted))
+    cases.update(_bench_landers(get_planet, wanted))
+    cases.update(_bench_sites(args.radius, args.seed, wanted))
+    with tempfile.TemporaryDirectory() as directory:
+        serialization_cases, sizes = _bench_serialization(args.radius, args.seed, directory, wanted)
+        cases.update(serialization_cases)
+        results = {}
+        for name, fn in cases.items():
+            if not wanted(name):
+                continue
+            results[name] = bench_case(fn, min_time=args.bench_min_time)
+            if name in sizes:
+                results[name]['bytes'] = sizes[name]
+    
+    report = {
+        'meta': {'python': sys.version.split()[0], 'numpy': np.__version__, 'cpus': os.cpu_count(),
+                 'radius': args.radius, 'details': args.details, 'seed': args.seed, 'terrain_error': terrain_error},
+        'results': results,
+    }
+    if args.bench_out:
+        with open(args.bench_out, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.bench_baseline:
+        with open(args.bench_baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_benchmarks(results, baseline, args.bench_tolerance, args.bench_noise_us * 1e-6)
+        print(f"Регрессий: {len(regressions)}")
+        return not regressions
+    if not args.bench_out:
+        print(json.dumps(report, indent=1, sort_keys=True))
+    return True
+
+def parse_args(argv=None):
+    # Файл --config задаёт значения по умолчанию (ключи - имена параметров, как в vars(args)),
+    # явно указанные параметры командной строки важнее
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument("--config")
+    config_path = pre.parse_known_args(argv)[0].config
+    
+    parser = argparse.ArgumentParser(prog="LandingSim")
+    parser.add_argument("--config", default=None, help="JSON-файл конфигурации")
+    parser.add_argument("--headless", action="store_true", help="посадка без окна и OpenGL, результат в JSON")
+    parser.add_argument("--lander", type=float, nargs=6, default=(0, 0, 8, 0.01, 0, -0.1),
+                        metavar=("LON", "LAT", "HEIG", "V_LON", "V_LAT", "V_HEIG"),
+                        help="долгота и широта в градусах, высота, скорости")
+    parser.add_argument("--size", type=float, default=0.1)
+    parser.add_argument("--spawn", action="store_true", help="создать лендер --lander сразу при запуске окна")
+    parser.add_argument("--radius-render", type=int, default=3, help="радиус прорисовки в секторах")
+    parser.add_argument("--center", type=int, nargs=2, default=(0, 0), metavar=("LON", "LAT"), help="центр области в градусах")
+    parser.add_argument("--quadtree", action="store_true", help="вся планета квадродеревьями на гранях куба вместо секторов 1°")
+    parser.add_argument("--quadtree-error", type=float, default=2.0, help="допустимая ошибка узла квадродерева на экране, пикселей")
+    parser.add_argument("--sector-cache-mb", type=float, default=SECTOR_CACHE_BYTES / 2**20,
+                        help="память под сектора, ушедшие из окна, МБ")
+    parser.add_argument("--radius", type=float, default=7)
+    parser.add_argument("--details", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dt", type=float, default=1/60, help="фиксированный шаг физики")
+    parser.add_argument("--gravity", type=float, default=None,
+                        help="ускорение свободного падения у поверхности; по умолчанию пропорционально радиусу")
+    parser.add_argument("--mass", type=float, default=1.0)
+    parser.add_argument("--thrust", type=float, nargs=3, default=(0, 0, 0), metavar=("UP", "EAST", "NORTH"),
+                        help="постоянная тяга лендера")
+    parser.add_argument("--max-time", type=float, default=600.0)
+    parser.add_argument("--sweep", type=int, metavar="N", help="серия из N посадок по методу Монте-Карло")
+    parser.add_argument("--sweep-seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="sweep_out", help="каталог поколоночных результатов серии")
+    parser.add_argument("--tiles", default=DEFAULT_TILE_DIR, help="каталог кэша тайлов")
+    parser.add_argument("--tile-cache-mb", type=float, default=256, help="предел кэша тайлов на диске, МБ")
+    parser.add_argument("--bake", type=int, nargs=4, default=None, metavar=("LON0", "LAT0", "LON1", "LAT1"),
+                        help="заранее построить сектора прямоугольника (градусы, включительно) в кэш тайлов")
+    parser.add_argument("--bake-details", type=int, nargs="+", default=None, metavar="D",
+                        help="уровни детализации для --bake, по умолчанию --details")
+    parser.add_argument("--serve", default=None, metavar="ADDRESS",
+                        help="сервер симуляции: unix:ПУТЬ или [ХОСТ:]ПОРТ (по умолчанию хост 127.0.0.1)")
+    parser.add_argument("--sites", type=float, nargs=4, default=None, metavar=("LON0", "LAT0", "LON1", "LAT1"),
+                        help="самые пологие площадки прямоугольника (градусы), результат в JSON")
+    parser.add_argument("--sites-k", type=int, default=10, help="число площадок для --sites")
+    parser.add_argument("--sites-details", type=int, default=16, help="узлов карты на градус для --sites")
+    parser.add_argument("--sites-separation", type=float, default=0.25, help="наименьшее расстояние между площадками, градусы")
+    parser.add_argument("--sites-max-roughness", type=float, default=None, help="отбрасывать площадки с большей шероховатостью")
+    parser.add_argument("--record", default=None, metavar="FILE", help="записывать траектории лендеров в файл")
+    parser.add_argument("--record-every", type=int, default=1, metavar="N", help="писать каждый N-й шаг физики (касания - всегда)")
+    parser.add_argument("--replay", default=None, metavar="FILE", help="воспроизвести запись траекторий")
+    parser.add_argument("--seek", type=float, default=None, help="момент записи для --replay --headless, с")
+    parser.add_argument("--profile-csv", default=None, help="скользящий CSV со временем этапов каждого кадра")
+    parser.add_argument("--profile-rows", type=int, default=10000, help="строк в CSV до перехода к новому файлу")
+    parser.add_argument("--check-terrain", action="store_true", help="сверить рельеф с perlin_noise и выйти")
+    parser.add_argument("--bench", action="store_true", help="замеры горячих путей, результат в JSON")
+    parser.add_argument("--bench-out", default=None, help="файл для результата замеров")
+    parser.add_argument("--bench-baseline", default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--bench-tolerance", type=float, default=0.2, help="допустимое замедление относительно базы")
+    parser.add_argument("--bench-filter", default=None, help="только замеры, в имени которых есть подстрока")
+    parser.add_argument("--bench-min-time", type=float, default=1.5, help="минимальное суммарное время замеров одного случая, с")
+    parser.add_argument("--bench-noise-us", type=float, default=5.0,
+                        help="замедление меньше этого (мкс) не считается регрессией при любом отношении")
+    defaults = {"lon": "U:-5:5", "lat": "U:-5:5", "heig": "8", "v_lon": "0", "v_lat": "0", "v_heig": "N:-0.1:0.02"}
+    for name in SWEEP_PARAMETERS:
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=parse_distribution, default=parse_distribution(defaults[name]),
+                            metavar="SPEC", help="распределение для серии: X, U:a:b или N:mu:sigma")
+    if config_path:
+        with open(config_path) as f:
+            values = json.load(f)
+        unknown = set(values) - set(vars(parser.parse_args([])))
+        if unknown:
+            parser.error(f"неизвестные параметры в {config_path}: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**values)
+    return parser.parse_args(argv)
+
+def render_text(lines, color=(255, 255, 160)):
+    # Строки текста в картинки RGBA для glDrawPixels
+    font = pygame.font.SysFont("monospace", 14)
+    images = []
+    for line in lines:
+        surface = font.render(line, True, color, (0, 0, 0))
+        images.append((surface.get_width(), surface.get_height(), pygame.image.tostring(surface, "RGBA", True)))
+    return images
+
+def draw_text(images, x, top):
+    # Картинки строк сверху вниз от top (в пикселях окна, снизу вверх)
+    glDisable(GL_LIGHTING)
+    glDisable(GL_DEPTH_TEST)
+    for w, h, data in images:
+        top -= h
+        glWindowPos2i(x, top)
+        glDrawPixels(w, h, GL_RGBA, GL_UNSIGNED_BYTE, data)
+    glEnable(GL_DEPTH_TEST)
+
+PLANET_FIELDS = (("radius_render", "Радиус прорисовки", int), ("longitude", "Долгота центра", int),
+                 ("latitude", "Широта центра", int), ("radius", "Радиус планеты", float),
+                 ("details", "Детализация", int), ("seed", "Зерно рельефа", int))
+LANDER_FIELDS = (("lon", "Долгота", float), ("lat", "Широта", float), ("heig", "Высота", float),
+                 ("v_lon", "Скорость по долготе", float), ("v_lat", "Скорость по широте", float),
+                 ("v_heig", "Скорость по высоте", float), ("size", "Размер", float))
+
+class InputForm:
+    # Форма ввода поверх окна вместо input(): клавиши редактируют поля, цикл кадров не останавливается.
+    # Tab и стрелки - переход между полями, Enter - принять, Esc - отмена
+    def __init__(self, title, fields, values, on_submit, notes=()):
+        self.title = title
+        self.fields = fields
+        self.text = [str(values[name]) for name, _, _ in fields]
+        self.on_submit = on_submit
+        self.notes = list(notes)
+        self.current = 0
+        self.error = ""
+        self._images = None
+    
+    def handle_key(self, event):
+        # True - форма закрыта
+        self._images = None
+        if event.key == pygame.K_ESCAPE:
+            return True
+        if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+            # Поля разбираются по одному, курсор переходит на первое неверное; ValueError из on_submit -
+            # недопустимое сочетание значений, форма остаётся открытой с его текстом
+            values = {}
+            for k, ((name, label, kind), text) in enumerate(zip(self.fields, self.text)):
+                try:
+                    values[name] = kind(text)
+                except ValueError:
+                    self.current = k
+                    self.error = f"неверное значение: {label}"
+                    return False
+            try:
+                self.on_submit(values)
+            except ValueError as e:
+                self.error = str(e)
+                return False
+            return True
+        if event.key in (pygame.K_TAB, pygame.K_DOWN):
+            self.current = (self.current + 1) % len(self.fields)
+        elif event.key == pygame.K_UP:
+            self.current = (self.current - 1) % len(self.fields)
+        elif event.key == pygame.K_BACKSPACE:
+            self.text[self.current] = self.text[self.current][:-1]
+        elif event.unicode and event.unicode.isprintable():
+            self.text[self.current] += event.unicode
+        return False
+    
+    def draw(self, height):
+        if self._images is None:
+            lines = [self.title] + self.notes
+            for k, (_, label, _) in enumerate(self.fields):
+                marker = ">" if k == self.current else " "
+                lines.append(f"{marker} {label}: {self.text[k]}")
+            lines.append(self.error or "Enter - принять, Esc - отмена")
+            self._images = render_text(lines, (200, 255, 200))
+        draw_text(self._images, 300, height - 4)
+
+class BackgroundJobs:
+    # Долгие действия окна - построение и загрузка планеты, сохранение - в отдельном потоке.
+    # Результат передаётся в done() из цикла кадров в poll()
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.jobs = []
+    
+    def submit(self, name, fn, *args, done=None):
+        print(f"{name}: в фоне...")
+        self.jobs.append((name, self.executor.submit(fn, *args), done))
+    
+    def busy(self):
+        return bool(self.jobs)
+    
+    def poll(self):
+        for job in [job for job in self.jobs if job[1].done()]:
+            self.jobs.remove(job)
+            name, future, done = job
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{name}: ошибка: {e}")
+                continue
+            if done is not None:
+                done(result)
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class FrameProfiler:
+    # Время этапов кадра и счётчики отрисовки. Конец каждого этапа отмечается mark(этап), время
+    # считается от предыдущей отметки. Выключенный профилировщик только проверяет флаг
+    STAGES = ("events", "physics", "streaming", "culling", "mesh", "draw", "hud", "swap")
+    COUNTERS = ("triangles", "lines", "draw_calls", "built", "build_ms")
+    
+    def __init__(self, csv_path=None, csv_rows=10000, window=60):
+        self.show = False
+        self.csv_path = csv_path
+        self.csv_rows = csv_rows
+        self.window = window
+        self.enabled = csv_path is not None
+        self.frames = []
+        self.frame = None
+        self._active = False
+        self._last = 0.0
+        self._start = time.perf_counter()
+        self._csv_file = None
+        self._csv_writer = None
+        self._csv_count = 0
+        self._overlay = []
+        self._overlay_time = 0.0
+    
+    def toggle(self):
+        self.show = not self.show
+        self.enabled = self.show or self.csv_path is not None
+        # Включение действует со следующего кадра
+        print(f"Профилировщик: {'ВКЛ' if self.show else 'ВЫКЛ'}")
+    
+    def begin_frame(self):
+        self._active = self.enabled
+        if not self._active:
+            return
+        self._last = time.perf_counter()
+        self.frame = dict.fromkeys(self.STAGES + self.COUNTERS, 0)
+    
+    def mark(self, stage):
+        if not self._active:
+            return
+        now = time.perf_counter()
+        self.frame[stage] += now - self._last
+        self._last = now
+    
+    def count(self, counter, value=1):
+        if self._active:
+            self.frame[counter] += value
+    
+    def end_frame(self):
+        if not self._active:
+            return
+        self.frames.append(self.frame)
+        del self.frames[:-self.window]
+        if self.csv_path is not None:
+            self._write_csv(self.frame)
+    
+    def _write_csv(self, frame):
+        # Скользящий журнал: после csv_rows строк файл переименовывается в .1 и начинается заново
+        if self._csv_writer is None or self._csv_count >= self.csv_rows:
+            if self._csv_file is not None:
+                self._csv_file.close()
+                os.replace(self.csv_path, self.csv_path + ".1")
+            self._csv_file = open(self.csv_path, 'w', newline='')
+            self._csv_writer = csv.writer(self._csv_file)
+            self._csv_writer.writerow(("time",) + tuple(stage + "_ms" for stage in self.STAGES) + self.COUNTERS)
+            self._csv_count = 0
+        self._csv_writer.writerow([f"{time.perf_counter() - self._start:.4f}"]
+                                  + [f"{frame[stage] * 1000:.3f}" for stage in self.STAGES]
+                                  + [round(frame[counter], 3) for counter in self.COUNTERS])
+        self._csv_count += 1
+    
+    def summary(self):
+        # Средние за последние window кадров
+        n = len(self.frames)
+        if n == 0:
+            return []
+        mean = {name: sum(frame[name] for frame in self.frames) / n for name in self.STAGES + self.COUNTERS}
+        total = sum(mean[stage] for stage in self.STAGES)
+        lines = [f"кадр {total * 1000:6.2f} мс (бюджет 16.7 мс)"]
+        lines += [f"{stage:10s} {mean[stage] * 1000:6.2f} мс" for stage in self.STAGES]
+        lines.append(f"треугольники {mean['triangles']:.0f}, линии {mean['lines']:.0f}, вызовов {mean['draw_calls']:.0f}")
+        lines.append(f"фон: сеток {mean['built'] * n:.0f} за {n} кадров, {mean['build_ms'] * n:.1f} мс")
+        return lines
+    
+    def draw_overlay(self, height):
+        # Текст перерисовывается в картинки не чаще 4 раз в секунду
+        now = time.perf_counter()
+        if now - self._overlay_time > 0.25:
+            self._overlay_time = now
+            self._overlay = render_text(self.summary())
+        draw_text(self._overlay, 4, height - 4)
+    
+    def close(self):
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = None
+
+def main(args=None):
+    if args is None:
+        args = parse_args([])
+    load_gl()
     pygame.init()
     display = (800, 600)
     pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
     pygame.display.set_caption("LandingSim")
     
-    planet = Planet(3, 0, 0, 7, 8)
+    store = TileStore(args.tiles, int(args.tile_cache_mb * 2**20))
+    # Значения форм C и F - из командной строки или файла конфигурации
+    planet_config = {'radius_render': args.radius_render, 'longitude': args.center[0], 'latitude': args.center[1],
+                     'radius': args.radius, 'details': args.details, 'seed': args.seed}
+    lander_config = dict(zip(("lon", "lat", "heig", "v_lon", "v_lat", "v_heig"), args.lander), size=args.size)
+    if args.quadtree:
+        planet = QuadtreePlanet(**planet_config, store=store, max_error=args.quadtree_error)
+    else:
+        planet = Planet(**planet_config, store=store, cache_bytes=int(args.sector_cache_mb * 2**20))
     
+    fleet = LanderFleet(planet.radius)
+    # Касание по треугольникам секторов; у квадродерева - по высоте под центром
+    fleet.collider = planet if isinstance(planet, Planet) else None
     lander = None
     camera = SectorCamera(planet, lander)
+    streamer = SectorStreamer()
+    jobs = BackgroundJobs()
+    form = None
+    
+    def set_planet(new_planet):
+        # Старая планета остаётся на экране, пока новая строится в фоне
+        nonlocal planet, camera
+        if new_planet is None:
+            return
+        planet.release_buffers()
+        planet = new_planet
+        fleet.radius = planet.radius
+        fleet.collider = planet if isinstance(planet, Planet) else None
+        camera = SectorCamera(planet, lander)
+        print("Планета готова")
+    
+    def create_planet(values):
+        if values['radius_render'] < 1:
+            raise ValueError("радиус прорисовки должен быть не меньше 1")
+        if values['details'] < 1:
+            raise ValueError("детализация должна быть не меньше 1")
+        if values['radius'] <= 0:
+            raise ValueError("радиус планеты должен быть больше 0")
+        if jobs.busy():
+            print("Дождитесь окончания предыдущей операции")
+            return
+        planet_config.update(values)
+        jobs.submit("Новая планета", build_planet, *(planet_config[name] for name, _, _ in PLANET_FIELDS), store,
+                    args.quadtree, args.quadtree_error, int(args.sector_cache_mb * 2**20), done=set_planet)
+    
+    def load_planet(values):
+        index = values['number'] - 1
+        if not 0 <= index < len(saved):
+            print("Неверный выбор")
+        elif jobs.busy():
+            print("Дождитесь окончания предыдущей операции")
+        else:
+            jobs.submit("Загрузка " + saved[index], Planet.load_from_file, saved[index], store, done=set_planet)
+    
+    def create_lander(values):
+        nonlocal lander
+        lander_config.update(values)
+        if lander and lander.exists:
+            lander.exists = False
+            print("Старый лендер удален")
+        lander = fleet.lander(fleet.spawn(math.radians(values['lon']), math.radians(values['lat']), values['heig'],
+                                          values['v_lon'], values['v_lat'], values['v_heig'], values['size'])[0])
+        camera.set_lander(lander)
+        if isinstance(planet, Planet):
+            streamer.prefetch(planet, lander.v_lon, lander.v_lat)
+        print("Новый лендер создан")
+    
+    site_map = None
+    
+    def find_sites():
+        # Площадки в окне секторов текущей планеты; карта пересоздаётся при смене радиуса или сида
+        nonlocal site_map
+        if site_map is None or (site_map.radius, site_map.seed) != (planet.radius, planet.seed):
+            site_map = SuitabilityMap(planet.radius, seed=planet.seed)
+        reach = planet.radius_render - 0.5
+        return site_map.best_sites(planet.longitude - reach, planet.latitude - reach, planet.longitude + reach,
+                                   planet.latitude + reach, k=5)
+    
+    def choose_site(sites):
+        # Форма лендера с координатами самой пологой площадки, остальные - подсказкой
+        nonlocal form
+        if not len(sites['lon']):
+            print("Площадок не найдено")
+            return
+        lander_config.update(lon=float(sites['lon'][0]), lat=float(sites['lat'][0]))
+        notes = [f"{k}. долгота {lon:.3f}, широта {lat:.3f}, уклон {slope:.2f}°, шероховатость {rough:.4f}"
+                 for k, (lon, lat, slope, rough) in enumerate(zip(sites['lon'], sites['lat'], sites['slope'], sites['roughness']), 1)]
+        form = InputForm("=== Создание нового лендера ===", LANDER_FIELDS, lander_config, create_lander, notes)
+    
+    saved = []
+    recorder = None
+    if args.record:
+        recorder = TrajectoryRecorder(args.record, fleet.step, args.record_every)
+        recorder.attach(fleet)
+    if args.spawn:
+        create_lander(lander_config)
+    # Воспроизведение записи: стрелки влево/вправо - на 1 с, PageUp/PageDown - на 10 с, K - пауза
+    reader = TrajectoryReader(args.replay) if args.replay else None
+    replay_time = reader.start if reader is not None else 0.0
+    replay_speed = 1.0
+    
+    def shutdown():
+        streamer.shutdown()
+        jobs.shutdown()
+        profiler.close()
+        if recorder is not None:
+            recorder.close()
+        if reader is not None:
+            reader.close()
+        pygame.quit()
     
     glEnable(GL_DEPTH_TEST)
     glEnable(GL_CULL_FACE)
     glCullFace(GL_BACK)
     
     clock = pygame.time.Clock()
+    profiler = FrameProfiler(args.profile_csv, args.profile_rows)
     show_axes = True
     wireframe_mode = True
+    hud_key = None
+    hud_time = -math.inf
+    hud_altitude = 0.0
+    hud_hidden = False
     
     print("=== LandingSim ===")
     print("Управление:")
     print("W - переключить Wireframe/Solid режим")
     print("A - показать/скрыть оси координат")
     print("C - создать новую планету")
-    #print("L - загрузить сохраненную область")
-    #print("S - сохранить текущую область")
+    print("L - загрузить сохраненную область")
+    print("S - сохранить текущую область")
     print("R - сброс камеры")
-    print("F - создать/удалить лендер")
+    print("F - создать новый лендер")
+    print("G - создать лендер над самой пологой площадкой в окне")
     print("SPACE - переключить привязку камеры к лендеру")
+    print("P - показать/скрыть профилировщик кадра")
+    if args.replay:
+        print("Стрелки влево/вправо, PageUp/PageDown - перемотка записи, K - пауза")
     print("Колесо мыши - приближение/отдаление")
     print("ЛКМ + движение - вращение камеры")
+    print("ПКМ - координаты точки рельефа под курсором")
     print(f"Текущий режим: {'WIREFRAME' if wireframe_mode else 'SOLID'}")
     
     while True:
         dt = clock.tick(60) / 1000.0
+        profiler.begin_frame()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                pygame.quit()
+                shutdown()
                 return
+            elif event.type == pygame.KEYDOWN and form is not None:
+                # Пока открыта форма, клавиши идут только в неё
+                if form.handle_key(event):
+                    form = None
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
-                    pygame.quit()
+                    shutdown()
                     return
+                elif event.key == pygame.K_p:
+                    profiler.toggle()
+                elif reader is not None and event.key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_PAGEUP, pygame.K_PAGEDOWN):
+                    seek = {pygame.K_LEFT: -1, pygame.K_RIGHT: 1, pygame.K_PAGEDOWN: -10, pygame.K_PAGEUP: 10}[event.key]
+                    replay_time = min(max(replay_time + seek, reader.start), reader.end)
+                elif reader is not None and event.key == pygame.K_k:
+                    replay_speed = 1.0 - replay_speed
                 elif event.key == pygame.K_w:
                     wireframe_mode = not wireframe_mode
                     mode_name = "WIREFRAME" if wireframe_mode else "SOLID"
@@ -561,49 +3952,64 @@ def main():
                     camera.rotation_y = 0
                     camera.distance = 8.0
                 elif event.key == pygame.K_c:
-                    planet = CustomSector()
-                    camera = SectorCamera(planet, lander)
+                    form = InputForm("=== Создание новой планеты ===", PLANET_FIELDS, planet_config, create_planet)
+                elif event.key == pygame.K_l:
+                    saved = list_saved_areas()
+                    if saved:
+                        form = InputForm("=== Загрузка области ===", (("number", "Номер области", int),), {'number': 1},
+                                         load_planet, [f"{i}. {filename}" for i, filename in enumerate(saved, 1)])
+                elif event.key == pygame.K_s:
+                    if jobs.busy():
+                        print("Дождитесь окончания предыдущей операции")
+                    else:
+                        jobs.submit("Сохранение", planet.save_to_file)
                 elif event.key == pygame.K_f:
-                    if lander and lander.exists:
-                        lander.exists = False
-                        print("Старый лендер удален")
-                    asco = input("Default? y/n ")
-                    if asco == 'y':
-                        new_lander = Lander(0, 0, 8, 0.01, 0, 0, 0.1, planet.sectors[0][0].noise_surface(0, 0))
+                    form = InputForm("=== Создание нового лендера ===", LANDER_FIELDS, lander_config, create_lander)
+                elif event.key == pygame.K_g:
+                    if jobs.busy():
+                        print("Дождитесь окончания предыдущей операции")
                     else:
-                        print("\n=== Создание нового лендера ===")
-                        try:
-                            lon, lat, heig = map(float, input("Долгота, широта, высота: ").split())
-                            v_lon, v_lat, v_heig = map(float, input("Скорость по долготе, широте, высоте: ").split())
-                            size = float(input("Размер лендера: "))
-        
-                            lon_rad = math.radians(lon)
-                            lat_rad = math.radians(lat)
-                            heig_planet = planet.sectors[0][0].noise_surface(lon, lat)
-        
-                            new_lander = Lander(lon_rad, lat_rad, heig, v_lon, v_lat, v_heig, size, heig_planet)
-                        except ValueError:
-                            print("Ошибка ввода")
-                            new_lander = None
-                    if new_lander != None:
-                        lander = new_lander
-                        camera.set_lander(lander)
-                        print("Новый лендер создан")
+                        jobs.submit("Поиск площадки", find_sites, done=choose_site)
                 elif event.key == pygame.K_SPACE:
                     camera.toggle_follow_lander()
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 4: camera.zoom(-1.0)
                 elif event.button == 5: camera.zoom(1.0)
+                elif event.button == 3:
+                    origin, direction = camera.ray(*event.pos, *display)
+                    distance, point, normal = planet.raycast(origin, direction, camera.far)
+                    if np.isinf(distance[0]):
+                        print("Под курсором нет рельефа")
+                    else:
+                        x, y, z = point[0]
+                        r = math.sqrt(x * x + y * y + z * z)
+                        print(f"Точка рельефа: долгота {math.degrees(math.atan2(z, x)):.4f}, "
+                              f"широта {math.degrees(math.asin(y / r)):.4f}, высота {r - planet.radius:.4f}")
         
         if pygame.mouse.get_pressed()[0]:
             rel_x, rel_y = pygame.mouse.get_rel()
             camera.rotate(rel_x, rel_y)
         else:
             pygame.mouse.get_rel()
+        profiler.mark("events")
+        
+        # Физика фиксированным шагом, не зависящим от частоты кадров
+        fleet.advance(dt, planet.surface_height)
+        profiler.mark("physics")
         
+        jobs.poll()
+        lod_points = [camera.eye_position()]
         if lander and lander.exists:
-            lander.update_velocity(dt)
-            lander.update_height(planet.sectors[0][0].noise_surface(lander.lon, lander.lat))
+            lod_points.append(lander.display_position())
+        if isinstance(planet, Planet):
+            profiler.count("built", streamer.poll(planet))
+            profiler.count("build_ms", streamer.build_time * 1000)
+            planet.update_lod(lod_points)
+        else:
+            # Узлы квадродерева строятся в том же пуле потоков, что и сектора
+            profiler.count("built", planet.update_lod(lod_points, executor=streamer.executor))
+            profiler.count("build_ms", planet.build_time * 1000)
+        profiler.mark("streaming")
         
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         
@@ -613,13 +4019,27 @@ def main():
             WireframeMaterial.setup_wireframe()
         else:
             WireframeMaterial.setup_solid()
-        for i in range(len(planet.sectors)):
-            for j in range(len(planet.sectors[i])):
-                planet.sectors[i][j].draw_optimized(wireframe=wireframe_mode)
+        visible = planet.visible_sectors(camera.frustum_planes(), camera.eye_position())
+        profiler.mark("culling")
+        for sector in visible:
+            sector.prepare()
+        profiler.mark("mesh")
+        primitive = "lines" if wireframe_mode else "triangles"
+        for sector in visible:
+            profiler.count(primitive, sector.draw_optimized(wireframe=wireframe_mode))
+        profiler.count("draw_calls", len(visible))
         
         if lander and lander.exists:
             lander.draw()
-        if lander != None:
+            profiler.count("draw_calls")
+        if reader is not None:
+            replay_time = min(replay_time + dt * replay_speed, reader.end)
+            state = reader.state_at(replay_time)
+            if state is not None:
+                draw_markers(state['lon'], state['lat'], state['heig'])
+                profiler.count("draw_calls")
+        profiler.mark("draw")
+        if lander != None and isinstance(planet, Planet):
             ceil_lon = math.ceil(math.degrees(lander.lon))
             ceil_lat = math.ceil(math.degrees(lander.lat))
             delta_lon = ceil_lon - planet.longitude
@@ -627,17 +4047,65 @@ def main():
             if math.fabs(delta_lon) > 0.5 or math.fabs(delta_lat) > 0.5:
                 planet.longitude = ceil_lon
                 planet.latitude = ceil_lat
-                planet = update_sectors(planet, delta_lon, delta_lat)
+                planet = update_sectors(planet, delta_lon, delta_lat, streamer)
+                streamer.prefetch(planet, lander.v_lon, lander.v_lat)
                 #camera = SectorCamera(planet, lander)
+            profiler.mark("streaming")
         if show_axes:
             draw_coordinate_axes()
+            profiler.count("draw_calls")
+        profiler.mark("draw")
+        if profiler.show:
+            profiler.draw_overlay(display[1])
+        if form is not None:
+            form.draw(display[1])
         
         mode_text = "WIREFRAME" if wireframe_mode else "SOLID"
         lander_text = " + LANDER" if lander and lander.exists else ""
+        if lander and lander.exists and not lander.landed:
+            # Высотомер и видимость не чаще 10 раз в секунду и только если лендер или камера сдвинулись
+            now = time.perf_counter()
+            eye = camera.eye_position()
+            position = lander.display_position()
+            key = (id(planet), lander.index, eye, position)
+            if key != hud_key and now - hud_time > 0.1:
+                hud_key = key
+                hud_time = now
+                hud_altitude = lander.altitude()
+                hud_hidden = not line_of_sight(planet, eye, position)
+            lander_text += f" (высота над рельефом {hud_altitude:.3f})"
+            if hud_hidden:
+                lander_text += " [за рельефом]"
         follow_text = " [FOLLOW]" if camera.follow_lander else ""
-        pygame.display.set_caption(f"LandingSim - {mode_text}{lander_text}{follow_text}")
+        sectors_text = f" | секторы: {len(visible)}/{len(visible) + planet.culled}, отсечено {planet.culled}"
+        if isinstance(planet, Planet):
+            cache = planet.cache
+            sectors_text += f" | кэш: {cache.hits} попад., {cache.misses} пром., {cache.evictions} вытесн."
+        replay_text = f" | запись {replay_time:.1f}/{reader.end:.1f} с" if reader is not None else ""
+        pygame.display.set_caption(f"LandingSim - {mode_text}{lander_text}{follow_text}{sectors_text}{replay_text}")
+        profiler.mark("hud")
         
         pygame.display.flip()
+        profiler.mark("swap")
+        profiler.end_frame()
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.check_terrain:
+        print(f"Рельеф совпадает с perlin_noise, отклонение {check_terrain(seed=args.seed, radius=args.radius):g}")
+    elif args.bench:
+        sys.exit(0 if run_benchmarks(args) else 1)
+    elif args.serve:
+        sys.exit(0 if run_server(args) else 1)
+    elif args.bake:
+        run_bake(args)
+    elif args.sites:
+        run_sites(args)
+    elif args.sweep:
+        run_sweep(args)
+    elif args.replay and args.headless:
+        run_replay(args)
+    elif args.headless:
+        run_headless(args)
+    else:
+        main(args)